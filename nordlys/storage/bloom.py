@@ -0,0 +1,189 @@
+"""
+Bloom filter of surface forms, for skipping the lookups of n-grams that are not surface forms.
+
+- BloomFilter: bit array with k hash functions, derived from an md5 digest by double hashing; can be saved to and
+  loaded from a file.
+- FilteredSurfaceForms: wraps a surface form dictionary (SurfaceForms, SurfaceFormStore, ...) and consults the
+  filter before each lookup. A filter has no false negatives, so the lookups it skips would return None anyway.
+  The filter holds all surface forms of the dictionary, so it is rebuilt when the number of surface forms of the
+  dictionary differs from the number of items in the filter (i.e., the dictionary is changed after the filter is
+  built; see nordlys.wikipedia.updater).
+
+@author: Faegheh Hasibi (faegheh.hasibi@idi.ntnu.no)
+"""
+
+import hashlib
+import math
+import os
+import struct
+import threading
+
+# header of the filter file: number of bits, number of hash functions, number of items
+HEADER = struct.Struct("<QQQ")
+
+
+class BloomFilter(object):
+
+    def __init__(self, num_bits, num_hashes, num_items=0, bits=None):
+        """
+        :param num_bits: size of the bit array
+        :param num_hashes: number of hash functions
+        :param num_items: number of items added
+        :param bits: bytearray of the bits (a new, empty one is created if None)
+        """
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.num_items = num_items
+        self.bits = bits if bits is not None else bytearray((num_bits + 7) // 8)
+
+    @staticmethod
+    def create(capacity, fp_rate):
+        """
+        Creates an empty filter with the optimal size for the given capacity and false positive rate.
+
+        :param capacity: expected number of items
+        :param fp_rate: target false positive rate (e.g. 0.01)
+        """
+        capacity = max(1, capacity)
+        num_bits = int(math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        num_hashes = max(1, int(round(num_bits / float(capacity) * math.log(2))))
+        return BloomFilter(num_bits, num_hashes)
+
+    def __positions(self, item):
+        """Returns the bit positions of an item."""
+        if type(item) is unicode:
+            item = item.encode("utf-8")
+        h1, h2 = struct.unpack("<QQ", hashlib.md5(item).digest())
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        for pos in self.__positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.num_items += 1
+
+    def __contains__(self, item):
+        for pos in self.__positions(item):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def expected_fp_rate(self):
+        """Returns the expected false positive rate for the number of items added."""
+        return (1 - math.exp(-self.num_hashes * self.num_items / float(self.num_bits))) ** self.num_hashes
+
+    def save(self, file_name):
+        with open(file_name, "wb") as f:
+            f.write(HEADER.pack(self.num_bits, self.num_hashes, self.num_items))
+            f.write(self.bits)
+
+    @staticmethod
+    def load(file_name):
+        with open(file_name, "rb") as f:
+            num_bits, num_hashes, num_items = HEADER.unpack(f.read(HEADER.size))
+            bits = bytearray(f.read())
+        print "Bloom filter loaded from " + file_name
+        return BloomFilter(num_bits, num_hashes, num_items, bits)
+
+    @staticmethod
+    def build(items, capacity, fp_rate):
+        """
+        Builds a filter from items.
+
+        :param items: iterable of items
+        :param capacity: expected number of items
+        :param fp_rate: target false positive rate
+        """
+        bloom = BloomFilter.create(capacity, fp_rate)
+        for item in items:
+            bloom.add(item)
+            if bloom.num_items % 1000000 == 0:
+                print "Added", bloom.num_items, "th item to the bloom filter!"
+        return bloom
+
+
+class FilteredSurfaceForms(object):
+    """Surface form dictionary, where the lookups of surface forms that are not in the dictionary are skipped."""
+
+    def __init__(self, sf_dict, filter_file, fp_rate=0.01):
+        """
+        The filter is loaded from the filter file; if it does not exist or is stale (built from a dictionary of a
+        different size), it is built from the surface form dictionary and saved to the file.
+
+        :param sf_dict: surface form dictionary (with get, get_many, iter_surface_forms and len)
+        :param filter_file: path to the filter file
+        :param fp_rate: target false positive rate (only for building the filter)
+        """
+        self.sf_dict = sf_dict
+        num_sfs = len(sf_dict)
+        self.bloom = BloomFilter.load(filter_file) if os.path.exists(filter_file) else None
+        if (self.bloom is not None) and (self.bloom.num_items != num_sfs):
+            print "Bloom filter is stale (" + str(self.bloom.num_items) + " items, " + str(num_sfs) + \
+                " surface forms in the dictionary)"
+            self.bloom = None
+        if self.bloom is None:
+            print "Building bloom filter of surface forms ..."
+            self.bloom = BloomFilter.build(sf_dict.iter_surface_forms(), num_sfs, fp_rate)
+            self.bloom.save(filter_file)
+            print "Bloom filter saved to " + filter_file
+        self.__lock = threading.Lock()  # guards the counters; lookups may be done from multiple threads
+        self.lookups = 0
+        self.skipped = 0
+        self.false_positives = 0
+
+    def reconnect(self):
+        self.sf_dict.reconnect()
+
+    def __len__(self):
+        return len(self.sf_dict)
+
+    def iter_surface_forms(self):
+        return self.sf_dict.iter_surface_forms()
+
+    def get(self, surface_form):
+        """Returns all information associated with a surface form; the dictionary is not used for definite misses."""
+        if surface_form not in self.bloom:
+            with self.__lock:
+                self.lookups += 1
+                self.skipped += 1
+            return None
+        doc = self.sf_dict.get(surface_form)
+        with self.__lock:
+            self.lookups += 1
+            if doc is None:
+                self.false_positives += 1
+        return doc
+
+    def get_many(self, surface_forms):
+        """Returns all information associated with multiple surface forms; definite misses are not looked up."""
+        docs = {}
+        passed = []
+        for sf in surface_forms:
+            if sf in self.bloom:
+                passed.append(sf)
+            else:
+                docs[sf] = None
+        skipped = len(docs)
+        false_positives = 0
+        if len(passed) > 0:
+            for sf, doc in self.sf_dict.get_many(passed).iteritems():
+                if doc is None:
+                    false_positives += 1
+                docs[sf] = doc
+        with self.__lock:
+            self.lookups += len(surface_forms)
+            self.skipped += skipped
+            self.false_positives += false_positives
+        return docs
+
+    def stats(self):
+        """Returns filter statistics; the observed false positive rate is measured over the surface form misses."""
+        with self.__lock:
+            lookups, skipped, false_positives = self.lookups, self.skipped, self.false_positives
+        misses = skipped + false_positives
+        return {'lookups': lookups,
+                'skipped': skipped,
+                'false_positives': false_positives,
+                'fp_rate': false_positives / float(misses) if misses > 0 else 0.0,
+                'expected_fp_rate': self.bloom.expected_fp_rate(),
+                'items': self.bloom.num_items,
+                'mb': len(self.bloom.bits) / float(1024 ** 2)}
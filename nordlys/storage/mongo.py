@@ -5,6 +5,8 @@ Tools for working with MongoDB.
 """
 
 from pymongo import MongoClient
+from pymongo import UpdateOne
+from nordlys.tagme import instrument
 
 
 class Mongo(object):
@@ -32,8 +34,83 @@ class Mongo(object):
 
     def find_by_id(self, doc_id):
         """Returns all document content for a given document id."""
+        instrument.count(instrument.MONGO_LOOKUPS)
         return self.get_doc(self.collection.find_one({Mongo.ID_FIELD: self.escape(doc_id)}))
 
+    def find_by_ids(self, doc_ids, batch_size=10000):
+        """
+        Returns the contents of multiple documents, using one query (per batch) with the $in operator.
+
+        :param doc_ids: list of document ids
+        :param batch_size: maximum number of ids per query (keeps the query below the BSON size limit)
+        :return: dictionary {doc_id: doc, ...}; ids that are not found are left out
+        """
+        docs = {}
+        doc_ids = list(set(doc_ids))
+        for i in range(0, len(doc_ids), batch_size):
+            escaped_ids = {}  # ids are returned by MongoDB as unicode
+            for doc_id in doc_ids[i:i + batch_size]:
+                escaped_id = self.escape(doc_id)
+                escaped_ids[escaped_id.decode("utf-8") if type(escaped_id) is str else escaped_id] = doc_id
+            instrument.count(instrument.MONGO_LOOKUPS)  # one query per batch
+            for mdoc in self.collection.find({Mongo.ID_FIELD: {"$in": escaped_ids.keys()}}):
+                docs[escaped_ids[mdoc[Mongo.ID_FIELD]]] = self.get_doc(mdoc)
+        return docs
+
+    def find_all(self, fields=None):
+        """
+        Iterates over all documents of the collection.
+
+        :param fields: list of fields to be returned (all fields if None)
+        :return: generator of documents with keys and _id field unescaped
+        """
+        projection = {f: True for f in fields} if fields is not None else None
+        for mdoc in self.collection.find(projection=projection, no_cursor_timeout=True):
+            yield self.get_doc(mdoc)
+
+    def insert_docs(self, docs):
+        """
+        Inserts multiple documents using a single unordered bulk insert.
+        Documents should be already escaped (see escape()).
+
+        :param docs: list of documents
+        """
+        if len(docs) == 0:
+            return
+        self.collection.insert_many(docs, ordered=False)
+
+    def set_fields(self, docs_fields):
+        """
+        Sets (top-level) fields of multiple documents using a single unordered bulk operation.
+
+        :param docs_fields: dictionary {doc_id: {field: value, ...}, ...}
+        """
+        if len(docs_fields) == 0:
+            return
+        requests = []
+        for doc_id, fields in docs_fields.iteritems():
+            requests.append(UpdateOne({Mongo.ID_FIELD: self.escape(doc_id)},
+                                      {"$set": {self.escape(f): v for f, v in fields.iteritems()}}))
+        self.collection.bulk_write(requests, ordered=False)
+
+    def bulk_update(self, updates, upsert=False, batch_size=1000):
+        """
+        Updates multiple documents using unordered bulk operations.
+        Update specifications are used as is; field names should be already escaped.
+
+        :param updates: list of (doc_id, update specification, extra filter conditions or None)
+        :param upsert: inserts the documents that do not exist
+        :param batch_size: number of operations per bulk request
+        """
+        for i in range(0, len(updates), batch_size):
+            requests = []
+            for doc_id, update, condition in updates[i:i + batch_size]:
+                doc_filter = {Mongo.ID_FIELD: self.escape(doc_id)}
+                if condition is not None:
+                    doc_filter.update(condition)
+                requests.append(UpdateOne(doc_filter, update, upsert=upsert))
+            self.collection.bulk_write(requests, ordered=False)
+
     def get_doc(self, mdoc):
         """Returns document contents with with keys and _id field unescaped."""
         if mdoc is None:
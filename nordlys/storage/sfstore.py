@@ -0,0 +1,242 @@
+"""
+Read-only surface form store, memory-mapped from local files; an alternative to the MongoDB collection
+(see nordlys.storage.surfaceforms).
+
+Lookups are binary searches over a sorted string table of surface forms, done in-process. The files are only
+mapped into memory, so the data is loaded lazily by the OS and shared by all processes using the store.
+
+Files of the store directory:
+  - sfs.bin, sf_offsets.npy: Surface forms (utf-8), sorted; surface form i is sfs[sf_offsets[i]:sf_offsets[i+1]].
+  - ens.bin, en_offsets.npy: Entity URIs; entity ids index this table in the same way.
+  - <source>_ptr.npy, <source>_ens.npy, <source>_counts.npy: Entities of each source (anchor, title, ...) in CSR
+    format; entities of surface form i are ens[ptr[i]:ptr[i+1]] with counts[ptr[i]:ptr[i+1]].
+  - mention_freq.npy: Mention frequency of each surface form (-1 if not computed).
+  - meta.json: Number of surface forms and entities, and the list of sources.
+
+The store is built from the output of nordlys.wikipedia.merge_sf (or from a MongoDB collection):
+  python -m nordlys.storage.sfstore -input sf_dict_mongo.ndjson -output path/to/sfstore
+
+@author: Faegheh Hasibi (faegheh.hasibi@idi.ntnu.no)
+"""
+
+import argparse
+import json
+import mmap
+import os
+from array import array
+import numpy as np
+from nordlys.storage.mongo import Mongo
+from nordlys.storage.surfaceforms import SurfaceForms
+
+SFS_FILE = "sfs.bin"
+SF_OFFSETS_FILE = "sf_offsets.npy"
+ENS_FILE = "ens.bin"
+EN_OFFSETS_FILE = "en_offsets.npy"
+MENTION_FREQ_FILE = "mention_freq.npy"
+META_FILE = "meta.json"
+
+
+class SurfaceFormStore(object):
+    """Memory-mapped surface form store; has the same lookup interface as SurfaceForms."""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        meta = json.load(open(os.path.join(store_dir, META_FILE), "r"))
+        self.num_sfs = meta["num_sfs"]
+        self.sources = meta["sources"]
+        self.sfs = self.__map(os.path.join(store_dir, SFS_FILE))
+        self.sf_offsets = np.load(os.path.join(store_dir, SF_OFFSETS_FILE), mmap_mode="r")
+        self.ens = self.__map(os.path.join(store_dir, ENS_FILE))
+        self.en_offsets = np.load(os.path.join(store_dir, EN_OFFSETS_FILE), mmap_mode="r")
+        self.mention_freqs = np.load(os.path.join(store_dir, MENTION_FREQ_FILE), mmap_mode="r")
+        self.source_arrays = {}
+        for source in self.sources:
+            self.source_arrays[source] = [np.load(os.path.join(store_dir, source + suffix), mmap_mode="r")
+                                          for suffix in ["_ptr.npy", "_ens.npy", "_counts.npy"]]
+        print "Opened surface form store " + store_dir + " (" + str(self.num_sfs) + " surface forms)"
+
+    @staticmethod
+    def __map(file_name):
+        """Memory-maps a file (read-only)."""
+        with open(file_name, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return ""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def reconnect(self):
+        """Nothing to do; memory-mapped files can be shared with forked processes."""
+        pass
+
+    def __len__(self):
+        return self.num_sfs
+
+    def get_surface_form(self, sf_id):
+        return self.sfs[int(self.sf_offsets[sf_id]):int(self.sf_offsets[sf_id + 1])]
+
+    def get_entity(self, en_id):
+        return self.ens[int(self.en_offsets[en_id]):int(self.en_offsets[en_id + 1])]
+
+    def find(self, surface_form):
+        """Returns the id of the surface form (binary search); None if it is not in the store."""
+        if type(surface_form) is unicode:
+            surface_form = surface_form.encode("utf-8")
+        lo, hi = 0, self.num_sfs
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.get_surface_form(mid) < surface_form:
+                lo = mid + 1
+            else:
+                hi = mid
+        if (lo < self.num_sfs) and (self.get_surface_form(lo) == surface_form):
+            return lo
+        return None
+
+    def get(self, surface_form):
+        """Returns all information associated with a surface form (None if it is not found)."""
+        sf_id = self.find(surface_form)
+        if sf_id is None:
+            return None
+        return self.__get_doc(sf_id)
+
+    def get_many(self, surface_forms):
+        """
+        Returns all information associated with multiple surface forms.
+
+        :param surface_forms: list of surface forms
+        :return: dictionary {surface_form: doc, ...}; doc is None if the surface form is not found
+        """
+        return {sf: self.get(sf) for sf in surface_forms}
+
+    def __get_doc(self, sf_id):
+        """Returns the surface form record {source: {en: count, ...}, ...} in the same format as SurfaceForms."""
+        doc = {}
+        for source in self.sources:
+            ptr, ens, counts = self.source_arrays[source]
+            start, end = int(ptr[sf_id]), int(ptr[sf_id + 1])
+            if start == end:
+                continue
+            doc[source] = {self.get_entity(en_id): int(count) for en_id, count in zip(ens[start:end],
+                                                                                      counts[start:end])}
+        mention_freq = int(self.mention_freqs[sf_id])
+        if mention_freq >= 0:
+            doc[SurfaceForms.MENTION_FREQ] = mention_freq
+        return doc
+
+    def iter_surface_forms(self):
+        """Iterates over all surface forms (sorted)."""
+        for sf_id in xrange(self.num_sfs):
+            yield self.get_surface_form(sf_id)
+
+    def __iter__(self):
+        """Iterates over (surface form, record) pairs, sorted by surface form."""
+        for sf_id in xrange(self.num_sfs):
+            yield self.get_surface_form(sf_id), self.__get_doc(sf_id)
+
+
+def read_merged_file(json_file):
+    """
+    Reads the surface forms written by nordlys.wikipedia.merge_sf (json array or newline-delimited json).
+
+    :return: generator of (surface form, {source: {en: count}, ...})
+    """
+    with open(json_file, "r") as f:
+        is_array = f.read(1) == "["
+    if is_array:
+        entries = json.load(open(json_file, "r"))
+    else:
+        entries = (json.loads(line) for line in open(json_file, "r") if line.strip() != "")
+    for entry in entries:
+        sf = Mongo.unescape(entry.pop(Mongo.ID_FIELD))
+        yield sf, {f: {Mongo.unescape(en): count for en, count in value.iteritems()} if type(value) is dict else value
+                   for f, value in entry.iteritems()}
+
+
+def read_collection(collection):
+    """
+    Reads the surface forms of a MongoDB collection (e.g. to keep the mention frequencies).
+
+    :return: generator of (surface form, {source: {en: count}, ...})
+    """
+    sf_dict = SurfaceForms(collection)
+    for mdoc in sf_dict.mongo.find_all():
+        sf = mdoc.pop(Mongo.ID_FIELD)
+        yield sf, {f: {Mongo.unescape(en): count for en, count in value.iteritems()} if type(value) is dict else value
+                   for f, value in mdoc.iteritems()}
+
+
+def build_store(sf_records, output_dir):
+    """
+    Writes the surface form store.
+
+    :param sf_records: iterable of (surface form, {source: {en: count}, ...})
+    :param output_dir: path to the store directory
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    def encode(s):
+        return s.encode("utf-8") if type(s) is unicode else s
+
+    records = {}
+    en_set = set()
+    sources = set()
+    for sf, doc in sf_records:
+        record = {}
+        for f, value in doc.iteritems():
+            if type(value) is dict:
+                record[f] = {encode(en): count for en, count in value.iteritems()}
+                en_set.update(record[f])
+                sources.add(f)
+            else:
+                record[f] = value
+        records[encode(sf)] = record
+        if len(records) % 1000000 == 0:
+            print "Read", len(records), "th surface form!"
+    sfs = sorted(records)
+    ens = sorted(en_set)
+    en_ids = {en: en_id for en_id, en in enumerate(ens)}
+    sources = sorted(sources)
+
+    # string tables
+    for strings, data_file, offsets_file in [(sfs, SFS_FILE, SF_OFFSETS_FILE), (ens, ENS_FILE, EN_OFFSETS_FILE)]:
+        offsets = array("l", [0])
+        with open(os.path.join(output_dir, data_file), "wb") as f:
+            for s in strings:
+                f.write(s)
+                offsets.append(offsets[-1] + len(s))
+        np.save(os.path.join(output_dir, offsets_file), np.array(offsets, dtype=np.int64))
+
+    # entities of each source
+    for source in sources:
+        ptr, source_ens, counts = array("l", [0]), array("i"), array("i")
+        for sf in sfs:
+            en_counts = records[sf].get(source, {})
+            for en_id, count in sorted((en_ids[en], count) for en, count in en_counts.iteritems()):
+                source_ens.append(en_id)
+                counts.append(count)
+            ptr.append(len(source_ens))
+        np.save(os.path.join(output_dir, source + "_ptr.npy"), np.array(ptr, dtype=np.int64))
+        np.save(os.path.join(output_dir, source + "_ens.npy"), np.array(source_ens, dtype=np.int32))
+        np.save(os.path.join(output_dir, source + "_counts.npy"), np.array(counts, dtype=np.int32))
+
+    mention_freqs = np.array([records[sf].get(SurfaceForms.MENTION_FREQ, -1) for sf in sfs], dtype=np.int64)
+    np.save(os.path.join(output_dir, MENTION_FREQ_FILE), mention_freqs)
+    json.dump({"num_sfs": len(sfs), "num_entities": len(ens), "sources": sources},
+              open(os.path.join(output_dir, META_FILE), "w"))
+    print len(sfs), "surface forms and", len(ens), "entities are written to", output_dir
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-input", help="Surface form file written by merge_sf.py (.json or .ndjson)")
+    parser.add_argument("-collection", help="Surface form collection (instead of -input)")
+    parser.add_argument("-output", help="Path to the store directory")
+    args = parser.parse_args()
+
+    if args.collection is not None:
+        build_store(read_collection(args.collection), args.output)
+    else:
+        build_store(read_merged_file(args.input), args.output)
+
+if __name__ == "__main__":
+    main()
@@ -11,23 +11,97 @@ from nordlys.storage.mongo import Mongo
 
 
 class SurfaceForms(object):
+    # number of Wikipedia articles containing the surface form (see nordlys.wikipedia.keyphraseness)
+    MENTION_FREQ = "mention-freq"
 
     def __init__(self, collection):
         self.collection = collection
         self.mongo = Mongo(MONGO_HOST, MONGO_DB, self.collection)
 
+    def reconnect(self):
+        """Opens a new MongoDB connection (e.g. in a forked process, where the parent's client cannot be used)."""
+        self.mongo = Mongo(MONGO_HOST, MONGO_DB, self.collection)
+
+    def __len__(self):
+        return self.mongo.collection.estimated_document_count()
+
+    def iter_surface_forms(self):
+        """Iterates over all surface forms of the collection."""
+        for doc in self.mongo.find_all(fields=[Mongo.ID_FIELD]):
+            yield doc[Mongo.ID_FIELD]
+
     def get(self, surface_form):
         """Returns all information associated with a surface form."""
+        return self.__to_doc(self.mongo.find_by_id(surface_form))
 
-        # need to unescape the keys in the value part
-        mdoc = self.mongo.find_by_id(surface_form)
+    def get_many(self, surface_forms):
+        """
+        Returns all information associated with multiple surface forms, using a single MongoDB query.
+
+        :param surface_forms: list of surface forms
+        :return: dictionary {surface_form: doc, ...}; doc is None if the surface form is not found
+        """
+        mdocs = self.mongo.find_by_ids(surface_forms)
+        return {sf: self.__to_doc(mdocs.get(sf, None)) for sf in surface_forms}
+
+    @staticmethod
+    def __to_doc(mdoc):
+        """Converts a MongoDB document to a surface form record."""
         if mdoc is None:
             return None
+        # need to unescape the keys in the value part
         doc = {}
         for f in mdoc:
-            if f != Mongo.ID_FIELD:
+            if f == Mongo.ID_FIELD:
+                continue
+            if type(mdoc[f]) is dict:
                 doc[f] = {}
                 for key, value in mdoc[f].iteritems():
                     doc[f][Mongo.unescape(key)] = value
+            else:
+                doc[f] = mdoc[f]
+        return doc
+
+    def update_entity_counts(self, source, deltas):
+        """
+        Adds deltas to the entity counts of a source (e.g. anchor); entities whose counts are not positive anymore
+        are removed.
+
+        :param source: source of the surface forms ("anchor", "title", ...)
+        :param deltas: dictionary {(surface_form, en): delta, ...}
+        """
+        incs, unsets = [], []
+        for (sf, en), delta in deltas.iteritems():
+            if delta == 0:
+                continue
+            field = source + "." + Mongo.escape(en)
+            incs.append((sf, {"$inc": {field: delta}}, None))
+            if delta < 0:
+                unsets.append((sf, {"$unset": {field: ""}}, {field: {"$lte": 0}}))
+        self.mongo.bulk_update(incs, upsert=True)
+        self.mongo.bulk_update(unsets)
+
+    def set_entities(self, source, pairs, count=1):
+        """
+        Adds entities to the surface forms of a source (e.g. title or redirect).
+
+        :param pairs: list of (surface_form, en)
+        """
+        self.mongo.bulk_update([(sf, {"$set": {source + "." + Mongo.escape(en): count}}, None) for sf, en in pairs],
+                               upsert=True)
+
+    def remove_entities(self, source, pairs):
+        """
+        Removes entities from the surface forms of a source.
+
+        :param pairs: list of (surface_form, en)
+        """
+        self.mongo.bulk_update([(sf, {"$unset": {source + "." + Mongo.escape(en): ""}}, None) for sf, en in pairs])
+
+    def set_mention_freqs(self, mention_freqs):
+        """
+        Stores the number of articles containing each surface form.
 
-        return doc
\ No newline at end of file
+        :param mention_freqs: dictionary {surface_form: freq, ...}
+        """
+        self.mongo.set_fields({sf: {self.MENTION_FREQ: freq} for sf, freq in mention_freqs.iteritems()})
\ No newline at end of file
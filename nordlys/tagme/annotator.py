@@ -0,0 +1,127 @@
+"""
+Thread-safe TAGME annotator.
+
+An Annotator can be used from multiple threads at the same time (e.g. from a thread pool); Lucene searches release
+the GIL, so the searches of different texts overlap.
+  - The indices, in-link graph and spotter are opened once and shared read-only by all threads (see tagme.py).
+  - In-link counts and relatedness scores are kept in the process-wide caches of tagme.py, which are thread-safe.
+  - Threads are attached to the JVM before their first Lucene call.
+
+Usage:
+    annotator = Annotator(rho_th=0.1)
+    annotations = annotator.annotate_many(texts, threads=8)
+
+@author: Faegheh Hasibi (faegheh.hasibi@idi.ntnu.no)
+"""
+
+import argparse
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+from nordlys.tagme import config
+from nordlys.tagme import tagme
+from nordlys.tagme import test_coll
+from nordlys.tagme.tagme import Tagme
+from nordlys.tagme.query import Query
+from nordlys.tagme.lucene_tools import Lucene
+
+
+class Annotator(object):
+
+    def __init__(self, rho_th=0, batch_size=1000):
+        """
+        Opens the indices (and starts the JVM) in the calling thread.
+
+        :param rho_th: default rho score threshold
+        :param batch_size: number of texts whose surface forms are looked up at once (in annotate_many)
+        """
+        self.rho_th = rho_th
+        self.batch_size = batch_size
+        self.__local = threading.local()
+        tagme.open_indices()
+
+    def __attach_thread(self):
+        """Attaches the current thread to the JVM (once per thread)."""
+        if not getattr(self.__local, "attached", False):
+            Lucene.attach_current_thread()
+            self.__local.attached = True
+
+    def annotate(self, text, rho_th=None, qid="0", sf_matches=None):
+        """
+        Annotates a single text; can be called from any thread.
+
+        :param text: text to be annotated
+        :param rho_th: rho score threshold (default threshold of the annotator if None)
+        :param qid: query id
+        :param sf_matches: surface form records of n-grams that are already looked up (see tagme.lookup_surface_forms)
+        :return: linked entities {men: (en, score), ...}
+        """
+        self.__attach_thread()
+        tagme_obj = Tagme(Query(qid, text), self.rho_th if rho_th is None else rho_th, sf_matches=sf_matches)
+        return tagme_obj.prune(tagme_obj.disambiguate(tagme_obj.parse()))
+
+    def annotate_many(self, texts, threads=1, rho_th=None):
+        """
+        Annotates multiple texts with a pool of threads.
+        Surface forms of each batch of texts are looked up at once, before the texts are annotated.
+
+        :param texts: list of texts
+        :param threads: number of threads
+        :param rho_th: rho score threshold (default threshold of the annotator if None)
+        :return: list of linked entities [{men: (en, score), ...}, ...], in the order of the texts
+        """
+        pool = ThreadPool(threads) if threads > 1 else None
+        results = []
+        try:
+            for i in range(0, len(texts), self.batch_size):
+                batch = texts[i:i + self.batch_size]
+                self.__attach_thread()
+                sf_matches = {}
+                tagme.lookup_surface_forms([ngram for text in batch
+                                            for ngram in tagme.get_mention_ngrams(Query("0", text))], sf_matches)
+                jobs = [(str(i + j), text, rho_th, sf_matches) for j, text in enumerate(batch)]
+                if pool is not None:
+                    results.extend(pool.map(self.__annotate_job, jobs))
+                else:
+                    results.extend(self.__annotate_job(job) for job in jobs)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return results
+
+    def __annotate_job(self, job):
+        qid, text, rho_th, sf_matches = job
+        return self.annotate(text, rho_th, qid, sf_matches)
+
+    @staticmethod
+    def stats():
+        """Returns statistics of the shared caches."""
+        return {'in_links_cache': tagme.IN_LINKS_CACHE.stats(),
+                'mw_rel_cache': tagme.MW_REL_CACHE.stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-th", "--threshold", help="score threshold", type=float, default=0)
+    parser.add_argument("-data", help="Data set name", choices=['wiki-annot30', 'wiki-disamb30'],
+                        default="wiki-disamb30")
+    parser.add_argument("-threads", help="Number of threads", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.data == "wiki-annot30":
+        queries = test_coll.read_tagme_queries(config.WIKI_ANNOT30_SNIPPET)
+    else:
+        queries = test_coll.read_tagme_queries(config.WIKI_DISAMB30_SNIPPET)
+    texts = [queries[qid] for qid in sorted(queries)]
+
+    annotator = Annotator(args.threshold)
+    s_t = time.time()
+    annotator.annotate_many(texts, threads=args.threads)
+    elapsed = time.time() - s_t
+    print len(texts), "texts annotated with", args.threads, "threads in %.1f sec (%.1f texts/sec)" % \
+        (elapsed, len(texts) / elapsed if elapsed > 0 else 0)
+    print "caches:", annotator.stats()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""
+Self-contained benchmark of the TAGME pipeline.
+
+Builds a synthetic Wikipedia-like corpus, so that Tagme can be benchmarked without the Wikipedia dump,
+the real indices and MongoDB:
+  - articles are written in the WikiExtractor format (<doc id=.. title=..> with <a href=..> links), with
+    Zipf-distributed words and entity popularity; entity names share words, so mentions are ambiguous;
+  - the full-text and annotation indices are built with nordlys.wikipedia.indexer.Indexer;
+  - surface forms are extracted with the nordlys.wikipedia tools (annotations, anchor counts, page titles) and
+    kept in a local stand-in for the MongoDB surface form collection.
+
+Tagme is then run over synthetic queries (text windows of the generated articles) and, optionally, over the
+queries of a bundled test collection; throughput and per-stage latencies are reported.
+
+Usage: python -m nordlys.tagme.benchmark -docs 2000 -queries 500
+
+@author: Faegheh Hasibi (faegheh.hasibi@idi.ntnu.no)
+"""
+
+import argparse
+import bisect
+import json
+import os
+import random
+import time
+from urllib import quote
+from nordlys.config import OUTPUT_DIR
+from nordlys.tagme import config
+from nordlys.tagme import tagme
+from nordlys.tagme import test_coll
+from nordlys.tagme import instrument
+from nordlys.wikipedia import annot_extractor
+from nordlys.wikipedia import anchor_extractor
+from nordlys.wikipedia import pageid_extractor
+from nordlys.wikipedia.indexer import Indexer
+from nordlys.wikipedia.merge_sf import Merger
+from nordlys.wikipedia.inlink_extractor import extract_inlinks
+from nordlys.storage.sfstore import SurfaceFormStore, build_store
+from nordlys.storage.bloom import FilteredSurfaceForms
+
+SYLLABLES = ["ba", "ko", "ri", "ta", "mu", "le", "si", "no", "va", "de", "lo", "pi", "ga", "ne", "zu", "ma",
+             "ru", "te", "ki", "do", "fa", "hu", "se", "ya"]
+
+
+class DictSurfaceForms(object):
+    """In-memory stand-in for the surface form collection (see nordlys.storage.surfaceforms.SurfaceForms)."""
+
+    def __init__(self, sf_dict):
+        """
+        :param sf_dict: dictionary {surface_form: {source: {en: count, ...}, ...}, ...}
+        """
+        self.sf_dict = sf_dict
+
+    def reconnect(self):
+        pass
+
+    def __len__(self):
+        return len(self.sf_dict)
+
+    def iter_surface_forms(self):
+        return iter(self.sf_dict)
+
+    def get(self, surface_form):
+        """Returns all information associated with a surface form."""
+        doc = self.sf_dict.get(surface_form, None)
+        if doc is None:
+            return None
+        return {f: dict(value) if type(value) is dict else value for f, value in doc.iteritems()}
+
+    def get_many(self, surface_forms):
+        """Returns all information associated with multiple surface forms."""
+        return {sf: self.get(sf) for sf in surface_forms}
+
+    def save(self, file_name):
+        with open(file_name, "w") as f:
+            json.dump(self.sf_dict, f)
+
+    @staticmethod
+    def load(file_name):
+        with open(file_name, "r") as f:
+            sf_dict = json.load(f)
+        # keys are read as unicode; Tagme works with byte strings
+        return DictSurfaceForms({sf.encode("utf-8"): {source: {en.encode("utf-8"): count
+                                                               for en, count in ens.iteritems()}
+                                                      for source, ens in doc.iteritems()}
+                                 for sf, doc in sf_dict.iteritems()})
+
+
+class SyntheticWiki(object):
+    """Generates a Wikipedia-like corpus; the same parameters always give the same corpus."""
+
+    DOCS_PER_FILE = 100
+    FILES_PER_DIR = 100
+
+    def __init__(self, num_docs, vocab_size=5000, doc_len=300, link_rate=0.08, seed=0):
+        """
+        :param num_docs: number of articles (each article describes one entity)
+        :param vocab_size: number of distinct (non-entity) words
+        :param doc_len: average number of words per article
+        :param link_rate: probability of a link at each word position
+        :param seed: random seed
+        """
+        self.num_docs = num_docs
+        self.doc_len = doc_len
+        self.link_rate = link_rate
+        self.rng = random.Random(seed)
+        self.vocab = self.__gen_words(vocab_size)
+        self.titles, self.aliases = self.__gen_entities(num_docs)
+        self.word_cdf = self.__zipf_cdf(len(self.vocab))
+        self.entity_cdf = self.__zipf_cdf(num_docs)
+        self.docs = []  # list of articles; each article is a list of (text, linked entity title or None)
+
+    def __gen_words(self, num_words, min_syl=2, max_syl=4):
+        """Generates distinct pseudo words."""
+        words = []
+        seen = set()
+        while len(words) < num_words:
+            word = "".join(self.rng.choice(SYLLABLES) for _ in range(self.rng.randint(min_syl, max_syl)))
+            if word not in seen:
+                seen.add(word)
+                words.append(word)
+        return words
+
+    def __gen_entities(self, num_entities):
+        """
+        Generates entity titles and their aliases.
+        Titles are made of a first and a last name; last names are shared by many entities (ambiguous mentions).
+
+        :return: list of titles, list of aliases for each entity
+        """
+        first_names = [w.capitalize() for w in self.__gen_words(max(10, num_entities / 4), 3, 4)]
+        last_names = [w.capitalize() for w in self.__gen_words(max(10, num_entities / 20), 3, 4)]
+        types = ["band", "city", "film", "river"]
+        titles, aliases = [], []
+        seen = set()
+        while len(titles) < num_entities:
+            first, last = self.rng.choice(first_names), self.rng.choice(last_names)
+            title = first + " " + last
+            if title in seen:
+                title += " (" + self.rng.choice(types) + ")"
+            if title in seen:
+                continue
+            seen.add(title)
+            titles.append(title)
+            aliases.append([first + " " + last, last])
+        return titles, aliases
+
+    def __zipf_cdf(self, n, s=1.0):
+        """Cumulative distribution of a Zipf distribution over n items."""
+        cdf, total = [], 0.0
+        for rank in range(1, n + 1):
+            total += 1.0 / (rank ** s)
+            cdf.append(total)
+        return cdf
+
+    def __sample(self, cdf):
+        """Samples an item index from a cumulative distribution."""
+        return min(bisect.bisect(cdf, self.rng.random() * cdf[-1]), len(cdf) - 1)
+
+    def generate(self):
+        """Generates the articles (in memory)."""
+        self.docs = []
+        for i in range(self.num_docs):
+            doc = []
+            for _ in range(self.rng.randint(self.doc_len / 2, self.doc_len * 3 / 2)):
+                if self.rng.random() < self.link_rate:
+                    en = self.__sample(self.entity_cdf)
+                    if en != i:
+                        doc.append((self.rng.choice(self.aliases[en]), self.titles[en]))
+                        continue
+                doc.append((self.vocab[self.__sample(self.word_cdf)], None))
+            self.docs.append(doc)
+        return self
+
+    def write(self, corpus_dir):
+        """Writes the articles in WikiExtractor format: corpus_dir/AA/wiki_00, corpus_dir/AA/wiki_01, ..."""
+        out = None
+        for i, doc in enumerate(self.docs):
+            if i % self.DOCS_PER_FILE == 0:
+                if out is not None:
+                    out.close()
+                file_no = i / self.DOCS_PER_FILE
+                dir_no = file_no / self.FILES_PER_DIR
+                sub_dir = os.path.join(corpus_dir, chr(65 + dir_no / 26) + chr(65 + dir_no % 26))
+                if not os.path.exists(sub_dir):
+                    os.makedirs(sub_dir)
+                out = open(os.path.join(sub_dir, "wiki_%02d" % (file_no % self.FILES_PER_DIR)), "w")
+            page_id = str(i + 1)
+            out.write("<doc id=\"" + page_id + "\" url=\"http://en.wikipedia.org/wiki?curid=" + page_id +
+                      "\" title=\"" + self.titles[i] + "\">\n")
+            out.write(self.titles[i] + "\n\n")
+            for j in range(0, len(doc), 20):
+                words = []
+                for text, link in doc[j:j + 20]:
+                    words.append(text if link is None else "<a href=\"" + quote(link) + "\">" + text + "</a>")
+                out.write(" ".join(words) + "\n")
+            out.write("</doc>\n")
+        if out is not None:
+            out.close()
+
+    def gen_queries(self, num_queries, query_len):
+        """
+        Generates queries from random text windows of the articles.
+
+        :return: dictionary {qid: query}
+        """
+        queries = {}
+        for i in range(num_queries):
+            doc = self.docs[self.rng.randint(0, len(self.docs) - 1)]
+            start = self.rng.randint(0, max(0, len(doc) - query_len))
+            queries["s" + str(i)] = " ".join(text for text, _ in doc[start:start + query_len])
+        return queries
+
+
+def build_indices(corpus_dir, work_dir):
+    """Builds the full-text (with shingles) and annotation indices."""
+    Indexer(False, shingles=True).index_files(corpus_dir, os.path.join(work_dir, "index"))
+    Indexer(True).index_files(corpus_dir, os.path.join(work_dir, "index-annot"))
+
+
+def build_surface_forms(corpus_dir, work_dir):
+    """
+    Extracts surface forms from anchors and page titles (the synthetic corpus has no redirects).
+
+    :return: DictSurfaceForms object
+    """
+    annot_dir = os.path.join(work_dir, "annotations") + "/"
+    annot_extractor.add_dir(corpus_dir, annot_dir)
+    anchors_file = os.path.join(work_dir, "anchors.txt")
+    anchor_extractor.merge_anchors(annot_dir, anchors_file)
+    anchor_extractor.count_anchors(anchors_file, os.path.join(work_dir, "anchors_count.txt"))
+    pageid_extractor.read_files(corpus_dir, os.path.join(work_dir, "page-id-titles.txt"))
+
+    merger = Merger()
+    merger.add_anchors(os.path.join(work_dir, "anchors_count.txt"))
+    merger.add_titles(os.path.join(work_dir, "page-id-titles.txt"))
+    return DictSurfaceForms(merger.all_sfs)
+
+
+def run_queries(queries, rho_th):
+    """
+    Annotates queries and measures the throughput.
+
+    :return: list of query profiles, elapsed time (in seconds)
+    """
+    profiles = []
+    start = time.time()
+    for qid, query in sorted(queries.items()):
+        _, profile = tagme.annotate(qid, query, rho_th)
+        profiles.append(profile)
+    return profiles, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-docs", help="Number of articles", type=int, default=2000)
+    parser.add_argument("-vocab", help="Vocabulary size", type=int, default=5000)
+    parser.add_argument("-doclen", help="Average article length (in words)", type=int, default=300)
+    parser.add_argument("-queries", help="Number of synthetic queries", type=int, default=500)
+    parser.add_argument("-qlen", help="Synthetic query length (in words)", type=int, default=10)
+    parser.add_argument("-seed", help="Random seed", type=int, default=0)
+    parser.add_argument("-data", help="Bundled data set to run in addition to the synthetic queries",
+                        choices=['y-erd', 'erd-dev', 'wiki-annot30', 'wiki-disamb30'])
+    parser.add_argument("-th", "--threshold", help="score threshold", type=float, default=0)
+    parser.add_argument("-rounds", help="Number of runs over the queries (caches are kept between runs)",
+                        type=int, default=1)
+    parser.add_argument("-engine", help="Disambiguation engine", choices=['loop', 'matrix'],
+                        default=config.DISAMB_ENGINE)
+    parser.add_argument("-maxcands", help="Top-N candidates (by commonness) per mention", type=int,
+                        default=config.MAX_CANDIDATES)
+    parser.add_argument("-maxzero", help="Maximum number of zero-commonness candidates per mention", type=int,
+                        default=config.MAX_ZERO_CMN_CANDIDATES)
+    parser.add_argument("-prune", help="Pruning of candidates (upper bounds: loop engine only)", action="store_true",
+                        default=config.DISAMB_PRUNING)
+    parser.add_argument("-rel", help="Backend for counting in-links", choices=['lucene', 'inlink_graph'],
+                        default=config.REL_BACKEND)
+    parser.add_argument("-linkprob", help="Source of mention frequencies for link probabilities",
+                        choices=['phrase', 'shingles'], default=config.LINK_PROB_SOURCE)
+    parser.add_argument("-sf", help="Surface form store: in-memory dictionary or memory-mapped store",
+                        choices=['dict', 'sfstore'], default="dict")
+    parser.add_argument("-bloom", help="Skips lookups of n-grams that are not surface forms using a bloom filter",
+                        action="store_true", default=False)
+    parser.add_argument("-workdir", help="Directory for the corpus and indices", default=OUTPUT_DIR + "/benchmark")
+    parser.add_argument("-reuse", help="Reuses the corpus and indices of the work directory",
+                        action="store_true", default=False)
+    args = parser.parse_args()
+
+    work_dir = args.workdir
+    corpus_dir = os.path.join(work_dir, "corpus") + "/"
+    sf_file = os.path.join(work_dir, "sf_dict.json")
+    wiki = SyntheticWiki(args.docs, args.vocab, args.doclen, seed=args.seed).generate()
+
+    build_times = {}
+    if args.reuse and os.path.exists(sf_file):
+        sf_store = DictSurfaceForms.load(sf_file)
+    else:
+        start = time.time()
+        wiki.write(corpus_dir)
+        build_times['corpus'] = time.time() - start
+        start = time.time()
+        build_indices(corpus_dir, work_dir)
+        build_times['indices'] = time.time() - start
+        start = time.time()
+        sf_store = build_surface_forms(corpus_dir, work_dir)
+        sf_store.save(sf_file)
+        build_times['surface forms'] = time.time() - start
+    if (args.rel == "inlink_graph") and not os.path.exists(os.path.join(work_dir, "inlinks")):
+        start = time.time()
+        extract_inlinks(os.path.join(work_dir, "index-annot"), os.path.join(work_dir, "inlinks"))
+        build_times['in-link graph'] = time.time() - start
+    if args.sf == "sfstore":
+        store_dir = os.path.join(work_dir, "sfstore")
+        if (not args.reuse) or (not os.path.exists(store_dir)):
+            start = time.time()
+            build_store(sf_store.sf_dict.iteritems(), store_dir)
+            build_times['sfstore'] = time.time() - start
+        sf_store = SurfaceFormStore(store_dir)
+    if args.bloom:
+        filter_file = os.path.join(work_dir, "sf.bloom")
+        if (not args.reuse) and os.path.exists(filter_file):
+            os.remove(filter_file)
+        start = time.time()
+        sf_store = FilteredSurfaceForms(sf_store, filter_file)
+        build_times['bloom filter'] = time.time() - start
+
+    # Tagme takes its indices and surface forms from config
+    config.INDEX_PATH = os.path.join(work_dir, "index")
+    config.INDEX_ANNOT_PATH = os.path.join(work_dir, "index-annot")
+    config.INLINK_GRAPH_PATH = os.path.join(work_dir, "inlinks")
+    config.REL_BACKEND = args.rel
+    config.DISAMB_ENGINE = args.engine
+    config.DISAMB_PRUNING = args.prune
+    config.MAX_CANDIDATES = args.maxcands
+    config.MAX_ZERO_CMN_CANDIDATES = args.maxzero
+    config.LINK_PROB_SOURCE = args.linkprob
+    config.SF_WIKI = sf_store
+    tagme.open_indices()
+
+    query_sets = [("synthetic", wiki.gen_queries(args.queries, args.qlen))]
+    if args.data == "erd-dev":
+        query_sets.append((args.data, test_coll.read_erd_queries()))
+    elif args.data == "y-erd":
+        query_sets.append((args.data, test_coll.read_yerd_queries()))
+    elif args.data == "wiki-annot30":
+        query_sets.append((args.data, test_coll.read_tagme_queries(config.WIKI_ANNOT30_SNIPPET)))
+    elif args.data == "wiki-disamb30":
+        query_sets.append((args.data, test_coll.read_tagme_queries(config.WIKI_DISAMB30_SNIPPET)))
+
+    print "\n=== Benchmark (" + str(args.docs) + " articles, " + str(len(sf_store)) + " surface forms, " + \
+          "engine: " + args.engine + ", in-links: " + args.rel + ") ==="
+    for step, elapsed in sorted(build_times.items()):
+        print "%-28s%12.2f s" % ("build " + step, elapsed)
+    for name, queries in query_sets:
+        for r in range(args.rounds):
+            profiles, elapsed = run_queries(queries, args.threshold)
+            print "\n--- " + name + " queries, round " + str(r + 1) + " ---"
+            print "throughput: %.2f queries/s (%d queries in %.2f s)" % (len(profiles) / elapsed, len(profiles),
+                                                                          elapsed)
+            print instrument.summarize(profiles)
+    if args.bloom:
+        print "\nsurface form filter:", sf_store.stats()
+
+
+if __name__ == "__main__":
+    main()
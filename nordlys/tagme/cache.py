@@ -0,0 +1,105 @@
+"""
+Bounded LRU cache with hit/miss counters.
+
+Used for keeping values that are expensive to compute (e.g. in-link counts and relatedness scores)
+across queries within the same process. The cache can be shared between threads.
+
+@author: Faegheh Hasibi (faegheh.hasibi@idi.ntnu.no)
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+
+
+# Memory used by the cache for each item besides its key and value (measured on 64-bit CPython 2.7): the (value, size)
+# tuple and the size integer, the linked-list node of OrderedDict and the hash table slots of its two dictionaries.
+# The estimate is approximate; allocator rounding of small objects is not included.
+ITEM_OVERHEAD = 288
+
+
+class LRUCache(object):
+    """Least recently used cache, bounded by number of items and (estimated) memory usage."""
+
+    def __init__(self, max_items=None, max_mb=None):
+        """
+        :param max_items: maximum number of cached items (None for no limit)
+        :param max_mb: maximum memory (in MB) used by the cache, i.e. keys, values and the per-item overhead of
+            the cache structures (None for no limit)
+        """
+        self.max_items = max_items
+        self.max_bytes = max_mb * 1024 * 1024 if max_mb is not None else None
+        self.__items = OrderedDict()  # {key: (value, size)}, least recently used item comes first
+        self.__bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__lock = threading.Lock()
+        self.__local = threading.local()  # hits and misses of each thread
+
+    def __len__(self):
+        return len(self.__items)
+
+    def __contains__(self, key):
+        return key in self.__items
+
+    @staticmethod
+    def __sizeof(obj):
+        """Estimates memory usage of an object; only tuples are followed."""
+        size = sys.getsizeof(obj)
+        if type(obj) is tuple:
+            for item in obj:
+                size += sys.getsizeof(item)
+        return size
+
+    def thread_counts(self):
+        """Returns the [hits, misses] counters of the calling thread; they are updated in place."""
+        if not hasattr(self.__local, "counts"):
+            self.__local.counts = [0, 0]
+        return self.__local.counts
+
+    def get(self, key, default=None):
+        """Returns the cached value and marks it as recently used."""
+        counts = self.thread_counts()
+        with self.__lock:
+            item = self.__items.pop(key, None)
+            if item is None:
+                self.misses += 1
+                counts[1] += 1
+                return default
+            self.__items[key] = item
+            self.hits += 1
+            counts[0] += 1
+            return item[0]
+
+    def put(self, key, value):
+        """Adds value to the cache and evicts least recently used items if the cache is full."""
+        size = self.__sizeof(key) + self.__sizeof(value) + ITEM_OVERHEAD
+        with self.__lock:
+            old_item = self.__items.pop(key, None)
+            if old_item is not None:
+                self.__bytes -= old_item[1]
+            self.__items[key] = (value, size)
+            self.__bytes += size
+            while ((self.max_items is not None) and (len(self.__items) > self.max_items)) or \
+                    ((self.max_bytes is not None) and (self.__bytes > self.max_bytes) and (len(self.__items) > 1)):
+                _, (_, evicted_size) = self.__items.popitem(last=False)
+                self.__bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """Removes all items and resets the counters."""
+        with self.__lock:
+            self.__items.clear()
+            self.__bytes = 0
+            self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def stats(self):
+        """Returns cache statistics."""
+        lookups = self.hits + self.misses
+        return {'items': len(self.__items),
+                'mb': round(self.__bytes / (1024.0 * 1024.0), 2),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / float(lookups), 4) if lookups > 0 else 0}
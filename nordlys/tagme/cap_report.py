@@ -0,0 +1,112 @@
+"""
+Reports the effect of the candidate limits (config.MAX_CANDIDATES and config.MAX_ZERO_CMN_CANDIDATES) on the
+latency and the accuracy of TAGME on Wiki-disamb30.
+
+For each setting, all queries are annotated (with cold relatedness caches, so that the settings are comparable),
+the run file is written to the output directory and evaluated with scripts.evaluator_disamb. The report lists
+latency percentiles (total and disambiguation), the number of candidates per query and precision, recall and F1.
+
+Usage: python -m nordlys.tagme.cap_report -maxcands none,50,20,10,5 -maxzero none,5,0
+
+@author: Faegheh Hasibi (faegheh.hasibi@idi.ntnu.no)
+"""
+
+import argparse
+import numpy as np
+from nordlys.config import OUTPUT_DIR
+from nordlys.tagme import config
+from nordlys.tagme import tagme
+from nordlys.tagme import test_coll
+from scripts.evaluator_disamb import EvaluatorDisamb, erd_eval_query, parse_file
+
+
+def parse_limits(limits):
+    """Parses a comma-separated list of limits; "none" stands for no limit."""
+    return [None if limit.strip().lower() == "none" else int(limit) for limit in limits.split(",")]
+
+
+def limit_str(limit):
+    return "none" if limit is None else str(limit)
+
+
+def run_setting(queries, qrels_file, max_candidates, max_zero_cmn, rho_th=0):
+    """
+    Annotates the queries with the given candidate limits and evaluates the results.
+
+    :return: dictionary with latency, candidate and accuracy statistics of the setting
+    """
+    config.MAX_CANDIDATES = max_candidates
+    config.MAX_ZERO_CMN_CANDIDATES = max_zero_cmn
+    tagme.IN_LINKS_CACHE.clear()
+    tagme.MW_REL_CACHE.clear()
+
+    run_file = OUTPUT_DIR + "/wiki-disamb30_tagme_caps_" + limit_str(max_candidates) + "_" + \
+        limit_str(max_zero_cmn) + ".txt"
+    profiles = []
+    with open(run_file, "w") as out_file:
+        for qid, query in sorted(queries.items()):
+            linked_ens, profile = tagme.annotate(qid, query, rho_th)
+            profiles.append(profile)
+            out_file.write(tagme.to_str(qid, linked_ens))
+
+    qrels, null_qrels = parse_file(qrels_file)
+    results = parse_file(run_file, res=True)[0]
+    metrics = EvaluatorDisamb(qrels, results, null_qrels=null_qrels).eval(erd_eval_query)
+
+    totals = [p['total'] for p in profiles]
+    candidates = [p['candidates'] for p in profiles]
+    stats = {'max_candidates': limit_str(max_candidates), 'max_zero_cmn': limit_str(max_zero_cmn)}
+    stats['p50'], stats['p95'], stats['p99'] = np.percentile(totals, [50, 95, 99])
+    stats['max'] = max(totals)
+    stats['disamb_p95'] = np.percentile([p['disambiguate'] for p in profiles], 95)
+    stats['cands_mean'] = np.mean(candidates)
+    stats['cands_max'] = max(candidates)
+    stats.update(metrics)
+    return stats
+
+
+def to_table(settings_stats):
+    """Returns the report as a text table."""
+    out_str = "%-10s%-10s%10s%10s%10s%10s%12s%10s%10s%8s%8s%8s\n" % \
+              ("maxcands", "maxzero", "p50 ms", "p95 ms", "p99 ms", "max ms", "disamb p95", "cands", "cands max",
+               "prec", "rec", "F1")
+    for s in settings_stats:
+        out_str += "%-10s%-10s%10.1f%10.1f%10.1f%10.1f%12.1f%10.1f%10d%8.4f%8.4f%8.4f\n" % \
+                   (s['max_candidates'], s['max_zero_cmn'], s['p50'], s['p95'], s['p99'], s['max'], s['disamb_p95'],
+                    s['cands_mean'], s['cands_max'], s['prec'], s['rec'], s['f'])
+    return out_str
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-maxcands", help="Top-N limits to evaluate (comma-separated; none: no limit)",
+                        default="none,100,50,20,10,5")
+    parser.add_argument("-maxzero", help="Zero-commonness limits to evaluate (comma-separated; none: no limit)",
+                        default="none,10,3,0")
+    parser.add_argument("-grid", help="Evaluates all combinations of the limits (otherwise, one limit at a time)",
+                        action="store_true", default=False)
+    parser.add_argument("-qrels", help="Qrels file of Wiki-disamb30", default="qrels/qrels_wiki-disamb30.txt")
+    args = parser.parse_args()
+
+    max_cands, max_zeros = parse_limits(args.maxcands), parse_limits(args.maxzero)
+    if args.grid:
+        settings = [(n, z) for n in max_cands for z in max_zeros]
+    else:
+        settings = [(None, None)] + [(n, None) for n in max_cands if n is not None] + \
+                   [(None, z) for z in max_zeros if z is not None]
+
+    queries = test_coll.read_tagme_queries(config.WIKI_DISAMB30_SNIPPET)
+    tagme.open_indices()
+    settings_stats = []
+    for max_candidates, max_zero_cmn in settings:
+        print "\n=== maxcands: " + limit_str(max_candidates) + ", maxzero: " + limit_str(max_zero_cmn) + " ==="
+        settings_stats.append(run_setting(queries, args.qrels, max_candidates, max_zero_cmn))
+
+    report = to_table(settings_stats)
+    report_file = OUTPUT_DIR + "/wiki-disamb30_tagme_caps_report.txt"
+    open(report_file, "w").write(report)
+    print "\n" + report
+    print "report:", report_file
+
+if __name__ == "__main__":
+    main()
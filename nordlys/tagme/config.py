@@ -6,6 +6,8 @@ Configurations for tagme package.
 
 from nordlys.config import DATA_DIR
 from nordlys.storage.surfaceforms import SurfaceForms
+from nordlys.storage.sfstore import SurfaceFormStore
+from nordlys.storage.bloom import FilteredSurfaceForms
 
 
 # Test collection files
@@ -24,8 +26,67 @@ WIKI_DISAMB30_ANNOTATION = DATA_DIR + "/wiki-disamb30-annotation.txt"
 
 # Surface form dictionaries
 COLLECTION_SURFACEFORMS_WIKI = "surfaceforms_wiki_20100408"
-SF_WIKI = SurfaceForms(collection=COLLECTION_SURFACEFORMS_WIKI)
+
+# Backend of the surface form dictionary: "mongo" (COLLECTION_SURFACEFORMS_WIKI) or "sfstore" (memory-mapped
+# local store built from the same data; see nordlys.storage.sfstore)
+SF_BACKEND = "mongo"
+SF_STORE_PATH = "/xxx/20100408-sfstore/"
+if SF_BACKEND == "sfstore":
+    SF_WIKI = SurfaceFormStore(SF_STORE_PATH)
+else:
+    SF_WIKI = SurfaceForms(collection=COLLECTION_SURFACEFORMS_WIKI)
+
+# Bloom filter of surface forms; lookups of n-grams that are not in the filter are skipped. The filter is built
+# from SF_WIKI and saved to SF_FILTER_PATH if the file does not exist (see nordlys.storage.bloom); None disables it.
+SF_FILTER_PATH = None
+SF_FILTER_FP_RATE = 0.01
+if SF_FILTER_PATH is not None:
+    SF_WIKI = FilteredSurfaceForms(SF_WIKI, SF_FILTER_PATH, SF_FILTER_FP_RATE)
 
 
 INDEX_PATH = "/xxx/20100408-index"
-INDEX_ANNOT_PATH = "/xxx/20100408-index-annot/"
\ No newline at end of file
+INDEX_ANNOT_PATH = "/xxx/20100408-index-annot/"
+
+# Lucene directory modes of the indices: "simple", "mmap" (index files are cached by the OS; fast start-up) or
+# "ram" (the index is copied to the JVM heap at start-up)
+INDEX_DIR_MODE = "mmap"
+INDEX_ANNOT_DIR_MODE = "mmap"
+
+# Source of mention frequencies for link probabilities (when they are not precomputed in the surface form
+# dictionary): "phrase" (phrase queries over the contents of INDEX_PATH) or "shingles" (document frequency of the
+# n-gram in the shingles field; the index should be built with indexer.py -shingles)
+LINK_PROB_SOURCE = "phrase"
+
+# Backend for counting entity in-links in relatedness computation: "lucene" (AND queries over INDEX_ANNOT_PATH)
+# or "inlink_graph" (memory-mapped snapshot of the annotation index; see nordlys.wikipedia.inlink_extractor)
+REL_BACKEND = "lucene"
+INLINK_GRAPH_PATH = "/xxx/20100408-inlinks/"
+
+# Process-wide caches of in-link counts and relatedness scores (shared by all Tagme instances)
+IN_LINKS_CACHE_ITEMS = 2000000
+IN_LINKS_CACHE_MB = 512
+MW_REL_CACHE_ITEMS = 2000000
+MW_REL_CACHE_MB = 512
+
+# Disambiguation engine: "loop" (pairwise votes, as in the paper) or "matrix" (votes computed from a relatedness
+# matrix of all candidates; gives the same output)
+DISAMB_ENGINE = "matrix"
+
+# Candidate limits per mention (None for no limit): top-N candidates by commonness, and the number of candidates
+# with zero commonness (entities matched only by title, title-nv or redirect); they bound the disambiguation cost
+# of ambiguous mentions (see nordlys.tagme.cap_report for their effect on latency and accuracy)
+MAX_CANDIDATES = None
+MAX_ZERO_CMN_CANDIDATES = None
+
+# Pruning of disambiguation (gives the same output): votes are not computed for candidates below the commonness
+# threshold; in the "loop" engine, vote accumulation also stops for candidates that cannot be among the top-k entities
+DISAMB_PRUNING = False
+
+# Spotter directory built from the surface form dictionary (see nordlys.tagme.spotter); all n-grams are looked up
+# if None
+SPOTTER_PATH = None
+
+# Coherence: "full" (every mention votes for all other mentions) or "window" (mentions vote only for mentions
+# within COHERENCE_WINDOW tokens; for long documents)
+COHERENCE = "full"
+COHERENCE_WINDOW = 50
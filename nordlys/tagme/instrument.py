@@ -0,0 +1,116 @@
+"""
+Instrumentation of the TAGME pipeline.
+
+- Process-wide counters of backend calls (MongoDB lookups, Lucene searches, in-link graph lookups).
+- Per-query profiles with timings of parse, disambiguation and pruning, backend calls and cache hits/misses.
+  Backend calls and cache hits/misses of a profile are counted per thread, so queries can be profiled while other
+  threads annotate other queries (e.g. with Annotator.annotate_many).
+- Summary of latencies (p50/p95/p99) over multiple queries.
+
+@author: Faegheh Hasibi (faegheh.hasibi@idi.ntnu.no)
+"""
+
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+import numpy as np
+
+# Counter names
+MONGO_LOOKUPS = "mongo_lookups"  # queries sent to MongoDB (see nordlys.storage.mongo)
+LUCENE_SEARCHES = "lucene_searches"
+GRAPH_LOOKUPS = "graph_lookups"
+
+# process-wide counters of backend calls {name: count}
+COUNTERS = defaultdict(int)
+COUNTERS_LOCK = threading.Lock()
+
+# counters of backend calls of each thread; used by the query profiles
+THREAD_COUNTERS = threading.local()
+
+
+def get_thread_counters():
+    """Returns the counters of the calling thread {name: count}."""
+    if not hasattr(THREAD_COUNTERS, "counters"):
+        THREAD_COUNTERS.counters = defaultdict(int)
+    return THREAD_COUNTERS.counters
+
+
+def count(name, n=1):
+    """Increments a process-wide counter and the counter of the calling thread (can be called from multiple threads)."""
+    with COUNTERS_LOCK:
+        COUNTERS[name] += n
+    get_thread_counters()[name] += n
+
+
+class QueryProfile(object):
+    """
+    Timings and backend calls of annotating a single query.
+    The profile should be created in the thread that annotates the query; only the backend calls and cache
+    hits/misses of that thread are counted.
+    """
+
+    STAGES = ["parse", "disambiguate", "prune"]
+
+    def __init__(self, qid, caches=None):
+        """
+        :param qid: query id
+        :param caches: dictionary {name: LRUCache}; hits and misses of these caches are recorded
+        """
+        self.qid = qid
+        self.caches = caches if caches is not None else {}
+        self.timings = {}
+        self.__counters = get_thread_counters()
+        self.__start_counters = dict(self.__counters)
+        self.__cache_counts = {name: cache.thread_counts() for name, cache in self.caches.iteritems()}
+        self.__start_caches = {name: tuple(counts) for name, counts in self.__cache_counts.iteritems()}
+        self.__start_time = time.time()
+
+    @contextmanager
+    def stage(self, name):
+        """Measures the time (in ms) spent in a stage."""
+        start = time.time()
+        yield
+        self.timings[name] = (time.time() - start) * 1000
+
+    def to_dict(self):
+        """Returns the profile of the query; counters are the differences since the profile is created."""
+        profile = {'qid': self.qid, 'total': (time.time() - self.__start_time) * 1000}
+        profile.update(self.timings)
+        for name in COUNTERS.keys():
+            profile[name] = self.__counters.get(name, 0) - self.__start_counters.get(name, 0)
+        for name, (hits, misses) in self.__start_caches.iteritems():
+            profile[name + "_hits"] = self.__cache_counts[name][0] - hits
+            profile[name + "_misses"] = self.__cache_counts[name][1] - misses
+        return profile
+
+
+def write_profiles(profiles, out_file):
+    """Writes query profiles as JSON lines."""
+    with open(out_file, "w") as f:
+        for profile in profiles:
+            f.write(json.dumps(profile, sort_keys=True) + "\n")
+
+
+def summarize(profiles):
+    """
+    Returns a summary table of query profiles.
+    For each stage, latency percentiles (in ms) are listed; for other counters the mean per query and total.
+    """
+    if len(profiles) == 0:
+        return "No queries are profiled."
+    out_str = "%-28s%12s%12s%12s%12s\n" % ("stage (ms)", "mean", "p50", "p95", "p99")
+    for stage in QueryProfile.STAGES + ["total"]:
+        values = [p[stage] for p in profiles if stage in p]
+        if len(values) == 0:
+            continue
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        out_str += "%-28s%12.2f%12.2f%12.2f%12.2f\n" % (stage, np.mean(values), p50, p95, p99)
+    counters = sorted({key for p in profiles for key in p} - set(QueryProfile.STAGES + ["total", "qid"]))
+    out_str += "\n%-28s%12s%12s\n" % ("counter", "mean", "total")
+    for counter in counters:
+        values = [p.get(counter, 0) for p in profiles]
+        out_str += "%-28s%12.2f%12d\n" % (counter, np.mean(values), sum(values))
+    out_str += "\nqueries: " + str(len(profiles))
+    return out_str
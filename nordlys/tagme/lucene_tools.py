@@ -11,9 +11,13 @@ All Lucene features should be accessed in nordlys through this class.
 """
 
 import argparse
+import time
 import lucene
 from java.io import File
+from java.util import HashMap
 from org.apache.lucene.analysis.standard import StandardAnalyzer
+from org.apache.lucene.analysis.miscellaneous import PerFieldAnalyzerWrapper
+from org.apache.lucene.analysis.shingle import ShingleAnalyzerWrapper
 from org.apache.lucene.document import Document
 from org.apache.lucene.document import Field
 from org.apache.lucene.document import FieldType
@@ -21,14 +25,21 @@ from org.apache.lucene.index import IndexWriter
 from org.apache.lucene.index import IndexWriterConfig
 from org.apache.lucene.index import DirectoryReader 
 from org.apache.lucene.index import Term
+from org.apache.lucene.index import MultiFields
+from org.apache.lucene.index import DocsEnum
+from org.apache.lucene.index import FieldInfo
 from org.apache.lucene.search import IndexSearcher
+from org.apache.lucene.search import DocIdSetIterator
 from org.apache.lucene.search import BooleanClause
 from org.apache.lucene.search import TermQuery
 from org.apache.lucene.search import BooleanQuery
 from org.apache.lucene.search import PhraseQuery
+from org.apache.lucene.search import TotalHitCountCollector
 from org.apache.lucene.store import SimpleFSDirectory
+from org.apache.lucene.store import MMapDirectory
 from org.apache.lucene.store import RAMDirectory
 from org.apache.lucene.util import Version
+from org.apache.lucene.util import BytesRefIterator
 from org.apache.lucene.store import IOContext
 
 # has java VM for Lucene been initialized
@@ -40,6 +51,10 @@ class Lucene(object):
     # default fieldnames for id and contents
     FIELDNAME_ID = "id"
     FIELDNAME_CONTENTS = "contents"
+    # word n-grams (shingles) of the contents, for counting documents containing a phrase (see get_ngram_freq)
+    FIELDNAME_SHINGLES = "shingles"
+    # maximum n-gram length of the shingles field (same as the maximum mention length in tagme)
+    MAX_SHINGLE_SIZE = 6
 
     # internal fieldtypes
     # used as Enum, the actual values don't matter
@@ -48,8 +63,20 @@ class Lucene(object):
     FIELDTYPE_TEXT = "text"
     FIELDTYPE_TEXT_TV = "text_tv"
     FIELDTYPE_TEXT_TVP = "text_tvp"
+    FIELDTYPE_SHINGLES = "shingles"
 
-    def __init__(self, index_dir, use_ram=False, jvm_ram=None):
+    # directory modes
+    DIR_MODE_SIMPLE = "simple"  # SimpleFSDirectory; reads through file handles
+    DIR_MODE_MMAP = "mmap"  # MMapDirectory; index files are memory-mapped and cached by the OS
+    DIR_MODE_RAM = "ram"  # RAMDirectory; the whole index is copied to the JVM heap at start-up
+
+    def __init__(self, index_dir, use_ram=False, jvm_ram=None, dir_mode=None):
+        """
+        :param index_dir: index directory
+        :param use_ram: loads the index to RAMDirectory (same as dir_mode="ram"; kept for backward compatibility)
+        :param jvm_ram: maximum heap size of JVM (e.g. "8g")
+        :param dir_mode: "simple", "mmap" or "ram"; default is "ram" if use_ram is set, otherwise "simple"
+        """
         global lucene_vm_init
         if not lucene_vm_init:
             if jvm_ram:
@@ -59,10 +86,18 @@ class Lucene(object):
             else:
                 lucene.initVM(vmargs=['-Djava.awt.headless=true'])
             lucene_vm_init = True
-        self.dir = SimpleFSDirectory(File(index_dir))
+        if dir_mode is None:
+            dir_mode = self.DIR_MODE_RAM if use_ram else self.DIR_MODE_SIMPLE
+        if dir_mode == self.DIR_MODE_MMAP:
+            self.dir = MMapDirectory(File(index_dir))
+        elif dir_mode in (self.DIR_MODE_SIMPLE, self.DIR_MODE_RAM):
+            self.dir = SimpleFSDirectory(File(index_dir))
+        else:
+            raise Exception("Unknown directory mode " + str(dir_mode))
 
-        self.use_ram = use_ram
-        if use_ram:
+        self.dir_mode = dir_mode
+        self.use_ram = dir_mode == self.DIR_MODE_RAM
+        if self.use_ram:
             print "Using ram directory..."
             self.ram_dir = RAMDirectory(self.dir, IOContext.DEFAULT)
         self.analyzer = None
@@ -70,16 +105,34 @@ class Lucene(object):
         self.searcher = None
         self.writer = None
         self.ldf = None
-        print "Connected to index " + index_dir
+        print "Connected to index " + index_dir + " (" + dir_mode + ")"
+
+    @staticmethod
+    def attach_current_thread():
+        """
+        Attaches the calling thread to the JVM.
+        Must be called by any thread other than the one initializing the JVM, before using Lucene.
+        """
+        vm_env = lucene.getVMEnv()
+        if vm_env is not None:
+            vm_env.attachCurrentThread()
 
     def get_version(self):
         """Get Lucene version."""
         return Version.LUCENE_48
 
     def get_analyzer(self):
-        """Get analyzer."""
+        """
+        Get analyzer.
+        StandardAnalyzer is used for all fields; the shingles field is additionally tokenized into word n-grams
+        (1 to MAX_SHINGLE_SIZE words, separated by a single space).
+        """
         if self.analyzer is None:
-            self.analyzer = StandardAnalyzer(self.get_version())
+            std_analyzer = StandardAnalyzer(self.get_version())
+            field_analyzers = HashMap()
+            field_analyzers.put(self.FIELDNAME_SHINGLES,
+                                ShingleAnalyzerWrapper(std_analyzer, 2, self.MAX_SHINGLE_SIZE))
+            self.analyzer = PerFieldAnalyzerWrapper(std_analyzer, field_analyzers)
         return self.analyzer
 
     def open_reader(self):
@@ -117,15 +170,37 @@ class Lucene(object):
         self.open_searcher()
         return self.searcher
 
-    def open_writer(self):
-        """Open IndexWriter."""
+    def open_writer(self, ram_buffer_mb=None, append=False):
+        """
+        Open IndexWriter.
+
+        :param ram_buffer_mb: RAM buffer size (MB) for buffering added documents before flushing them to a segment
+        :param append: opens the existing index for updates (a new index is created otherwise)
+        """
         if self.writer is None:
             config = IndexWriterConfig(self.get_version(), self.get_analyzer())
-            config.setOpenMode(IndexWriterConfig.OpenMode.CREATE)
+            if append:
+                config.setOpenMode(IndexWriterConfig.OpenMode.CREATE_OR_APPEND)
+            else:
+                config.setOpenMode(IndexWriterConfig.OpenMode.CREATE)
+            if ram_buffer_mb is not None:
+                config.setRAMBufferSizeMB(float(ram_buffer_mb))
             self.writer = IndexWriter(self.dir, config)
         else:
             raise Exception("IndexWriter is already open")
 
+    def add_indexes(self, index_dirs):
+        """Adds the segments of other indices to the index (the writer should be open)."""
+        self.writer.addIndexes([SimpleFSDirectory(File(index_dir)) for index_dir in index_dirs])
+
+    def force_merge(self, max_segments):
+        """Merges the segments of the index until there are at most max_segments segments."""
+        self.writer.forceMerge(max_segments)
+
+    def force_merge_deletes(self):
+        """Merges away the deleted documents, which are otherwise still counted by docFreq (e.g. of shingles)."""
+        self.writer.forceMergeDeletes()
+
     def close_writer(self):
         """Close IndexWriter."""
         if self.writer is not None:
@@ -143,6 +218,16 @@ class Lucene(object):
             self.ldf = LuceneDocument()
         self.writer.addDocument(self.ldf.create_document(contents))
 
+    def update_document(self, doc_id, contents):
+        """Replaces the document having the given (external) id; the document is added if it does not exist."""
+        if self.ldf is None:
+            self.ldf = LuceneDocument()
+        self.writer.updateDocument(Term(self.FIELDNAME_ID, doc_id), self.ldf.create_document(contents))
+
+    def delete_document(self, doc_id):
+        """Deletes the document having the given (external) id."""
+        self.writer.deleteDocuments(Term(self.FIELDNAME_ID, doc_id))
+
     def get_lucene_document_id(self, doc_id):
         """Loads a document from a Lucene index based on its id."""
         self.open_searcher()
@@ -187,11 +272,69 @@ class Lucene(object):
             phq.add(Term(field, t))
         return phq
 
+    def count(self, query):
+        """
+        Returns the number of documents matching a query, without scoring or collecting top documents.
+        Term queries (and boolean queries with a single required term) are answered from the term dictionary
+        (docFreq), if the index has no deletions.
+        """
+        self.open_searcher()
+        if BooleanQuery.instance_(query):
+            clauses = BooleanQuery.cast_(query).getClauses()
+            if (len(clauses) == 1) and (clauses[0].getOccur() != BooleanClause.Occur.MUST_NOT):
+                query = clauses[0].getQuery()
+        if TermQuery.instance_(query) and not self.reader.hasDeletions():
+            return self.reader.docFreq(TermQuery.cast_(query).getTerm())
+        collector = TotalHitCountCollector()
+        self.searcher.search(query, collector)
+        return collector.getTotalHits()
+
+    def count_many(self, queries):
+        """Returns the number of matching documents for each query (see count)."""
+        return [self.count(query) for query in queries]
+
+    def get_ngram_freq(self, ngram):
+        """
+        Returns the number of documents containing an n-gram, using the shingles field (a single term lookup).
+        Gives the same count as a phrase query over the contents field. docFreq also counts the documents that are
+        deleted but not yet merged away, so the phrase query is counted instead if the index has deletions.
+
+        :param ngram: word n-gram (at most MAX_SHINGLE_SIZE words)
+        """
+        self.open_reader()
+        if self.reader.hasDeletions():
+            return self.count(self.get_phrase_query(ngram, self.FIELDNAME_CONTENTS))
+        return self.reader.docFreq(Term(self.FIELDNAME_SHINGLES, " ".join(ngram.split())))
+
     def num_docs(self):
         """Returns number of documents in the index."""
         self.open_reader()
         return self.reader.numDocs()
 
+    def iter_postings(self, field):
+        """
+        Iterates over all terms of a field together with their posting lists.
+        Deleted documents are skipped, so the posting lists are consistent with search results.
+
+        :param field: field name
+        :return: generator of (term, [lucene_doc_id, ...]); terms and doc ids are in increasing order
+        """
+        self.open_reader()
+        terms = MultiFields.getTerms(self.reader, field)
+        if terms is None:
+            return
+        live_docs = MultiFields.getLiveDocs(self.reader)
+        terms_enum = terms.iterator(None)
+        docs_enum = None
+        for term in BytesRefIterator.cast_(terms_enum):
+            docs_enum = terms_enum.docs(live_docs, docs_enum, DocsEnum.FLAG_NONE)
+            doc_ids = []
+            doc_id = docs_enum.nextDoc()
+            while doc_id != DocIdSetIterator.NO_MORE_DOCS:
+                doc_ids.append(doc_id)
+                doc_id = docs_enum.nextDoc()
+            yield term.utf8ToString(), doc_ids
+
 
 class LuceneDocument(object):
     """Internal representation of a Lucene document"""
@@ -252,6 +395,15 @@ class LuceneDocumentField(object):
         self.field_text_tvp.setStoreTermVectors(True)
         self.field_text_tvp.setStoreTermVectorPositions(True)
 
+        # FIELD_SHINGLES: not stored, indexed, tokenized, without frequencies, positions and norms
+        # (only document frequencies of the n-grams are used)
+        self.field_shingles = FieldType()
+        self.field_shingles.setIndexed(True)
+        self.field_shingles.setStored(False)
+        self.field_shingles.setTokenized(True)
+        self.field_shingles.setIndexOptions(FieldInfo.IndexOptions.DOCS_ONLY)
+        self.field_shingles.setOmitNorms(True)
+
     def get_field(self, type):
         """Get Lucene FieldType object for the corresponding internal FIELDTYPE_ value"""
         if type == Lucene.FIELDTYPE_ID:
@@ -264,19 +416,59 @@ class LuceneDocumentField(object):
             return self.field_text_tv
         elif type == Lucene.FIELDTYPE_TEXT_TVP:
             return self.field_text_tvp
+        elif type == Lucene.FIELDTYPE_SHINGLES:
+            return self.field_shingles
         else:
             raise Exception("Unknown field type")
 
 
+def benchmark_counts(l, field, num_queries):
+    """
+    Microbenchmark of hit counting: search(query, 1).totalHits vs. count() and count_many(), for term queries,
+    AND queries and phrase queries built from the first terms of a field.
+    """
+    l.open_searcher()
+    terms = []
+    terms_enum = MultiFields.getTerms(l.reader, field).iterator(None)
+    for term in BytesRefIterator.cast_(terms_enum):
+        terms.append(term.utf8ToString())
+        if len(terms) > num_queries:
+            break
+    pairs = zip(terms, terms[1:])
+    query_sets = [("term", [TermQuery(Term(field, t)) for t in terms[:num_queries]]),
+                  ("and", [l.get_and_query([TermQuery(Term(field, t1)), TermQuery(Term(field, t2))])
+                           for t1, t2 in pairs]),
+                  ("phrase", [l.get_phrase_query(t1 + " " + t2, field) for t1, t2 in pairs])]
+    for name, queries in query_sets:
+        s_t = time.time()
+        hits = [l.searcher.search(q, 1).totalHits for q in queries]
+        search_time = time.time() - s_t
+        s_t = time.time()
+        counts = [l.count(q) for q in queries]
+        count_time = time.time() - s_t
+        s_t = time.time()
+        counts_many = l.count_many(queries)
+        count_many_time = time.time() - s_t
+        mismatches = sum(1 for h, c, cm in zip(hits, counts, counts_many) if (h != c) or (h != cm))
+        print name + " queries (" + str(len(queries)) + "):",
+        print "search %.1f us, count %.1f us, count_many %.1f us per query; %d mismatches" % \
+            tuple([t * 1e6 / max(1, len(queries)) for t in [search_time, count_time, count_many_time]] + [mismatches])
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", "--index", help="index directory", type=str)
+    parser.add_argument("-bench", help="Benchmarks hit counting with this number of queries", type=int, default=0)
+    parser.add_argument("-field", help="Field of the benchmark queries", type=str, default=Lucene.FIELDNAME_CONTENTS)
     args = parser.parse_args()
 
     index_dir = args.index
     print "Index:       " + index_dir + "\n"
 
     l = Lucene(index_dir, jvm_ram="8g")
+    if args.bench > 0:
+        benchmark_counts(l, args.field, args.bench)
+        return
     pq = l.get_phrase_query("originally used", "contents")
 
     l.open_searcher()
@@ -6,14 +6,19 @@ Tools for processing mentions:
 @author: Faegheh Hasibi (faegheh.hasibi@idi.ntnu.no)
 """
 
-from nordlys.tagme.config import SF_WIKI
+from nordlys.tagme import config
+from nordlys.storage.surfaceforms import SurfaceForms
 
 
 class Mention(object):
 
-    def __init__(self, text):
+    def __init__(self, text, matched_ens=None):
+        """
+        :param text: mention text
+        :param matched_ens: surface form record of the mention, if it is already looked up ({} for no match)
+        """
         self.text = text.lower()
-        self.__matched_ens = None       # all entities matching a mention (from all sources)
+        self.__matched_ens = matched_ens  # all entities matching a mention (from all sources)
         self.__wiki_occurrences = None
 
     @property
@@ -24,10 +29,15 @@ class Mention(object):
     def wiki_occurrences(self):
         return self.__calc_wiki_occurrences()
 
+    @property
+    def mention_freq(self):
+        """Number of articles containing the mention; None if it is not precomputed."""
+        return self.matched_ens.get(SurfaceForms.MENTION_FREQ, None)
+
     def __gen_matched_ens(self):
         """Gets all entities matching the n-gram"""
         if self.__matched_ens is None:
-            matches = SF_WIKI.get(self.text)
+            matches = config.SF_WIKI.get(self.text)
             matched_ens = matches if matches is not None else {}
             self.__matched_ens = matched_ens
         return self.__matched_ens
@@ -40,23 +50,33 @@ class Mention(object):
                 self.__wiki_occurrences += occ
         return self.__wiki_occurrences
 
-    def get_men_candidate_ens(self, commonness_th):
+    def get_men_candidate_ens(self, commonness_th, max_candidates=None, max_zero_cmn=None):
         """
         Gets candidate entities for the given n-gram.
 
         :param commonness_th: commonness threshold
+        :param max_candidates: keeps only the top-N candidates with non-zero commonness (None for no limit)
+        :param max_zero_cmn: maximum number of candidates with zero commonness, i.e. entities matched only by
+            title, title-nv or redirect (None for no limit)
         :return: dictionary {Wiki_uri: commonness, ..}
         """
         candidate_entities = {}
-        wiki_matches = self.get_wiki_matches(commonness_th)
+        wiki_matches = self.get_wiki_matches(commonness_th, max_zero_cmn)
         candidate_entities.update(wiki_matches)
+        if (max_candidates is not None) and (len(candidate_entities) > max_candidates):
+            # ties are broken by uri, so that the same candidates are kept for the same mention
+            ranked = sorted([(-cmn, en) for en, cmn in candidate_entities.iteritems() if cmn > 0])
+            for _, en in ranked[max_candidates:]:
+                del candidate_entities[en]
         return candidate_entities
 
-    def get_wiki_matches(self, commonness_th):
+    def get_wiki_matches(self, commonness_th, max_zero_cmn=None):
         """
         Gets entity matches from Wikipedia anchors (with dbpedia uris).
 
         :param commonness_th: float, Commonness threshold
+        :param max_zero_cmn: maximum number of title, title-nv and redirect matches with zero commonness; they are
+            taken in the order of the sources (None for no limit)
         :return: Dictionary {Wiki_uri: commonness, ...}
 
         """
@@ -71,10 +91,15 @@ class Mention(object):
                 wiki_matches[wiki_uri] = cmn
 
         sources = ["title", "title-nv", "redirect"]
+        num_zero_cmn = 0
         for source in sources:
             for wiki_uri in self.matched_ens.get(source, {}):
                 if wiki_uri not in wiki_matches:
                     cmn = self.calc_commonness(wiki_uri)
+                    if cmn == 0:
+                        if (max_zero_cmn is not None) and (num_zero_cmn >= max_zero_cmn):
+                            continue
+                        num_zero_cmn += 1
                     wiki_matches[wiki_uri] = cmn
         return wiki_matches
 
@@ -37,3 +37,17 @@ class Query(object):
                     ngram += " " + con[start + j]
                 ngrams.append(ngram)
         return ngrams
+
+    def get_ngram_positions(self, max_len):
+        """
+        Finds start positions (in tokens) of all n-grams of the query up to the given length.
+
+        :param max_len: maximum number of words in an n-gram
+        :return dictionary {ngram: [start, ...], ...}
+        """
+        con = self.query.strip().split()
+        positions = {}
+        for start in range(0, len(con)):
+            for end in range(start + 1, min(start + max_len, len(con)) + 1):
+                positions.setdefault(" ".join(con[start:end]), []).append(start)
+        return positions
@@ -0,0 +1,246 @@
+"""
+HTTP/JSON service for annotating texts with TAGME.
+
+The indices and the surface form dictionary are opened once at start-up and kept warm.
+Requests are put in a queue and annotated in batches by a single annotation thread:
+  - identical texts in a batch are annotated only once;
+  - surface forms of all texts in a batch are looked up once;
+  - in-link counts and relatedness scores are shared between all requests (see IN_LINKS_CACHE and MW_REL_CACHE).
+
+Endpoints:
+  - POST /annotate  {"text": "..."} or {"texts": ["...", ...]}, optionally with "threshold" (rho score threshold)
+  - GET /stats      cache and batching statistics
+  - GET /health
+
+Usage: python -m nordlys.tagme.service -port 8090
+
+@author: Faegheh Hasibi (faegheh.hasibi@idi.ntnu.no)
+"""
+
+import argparse
+import json
+import threading
+import time
+import Queue
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from nordlys.tagme import config
+from nordlys.tagme import tagme
+from nordlys.tagme import instrument
+from nordlys.tagme.tagme import Tagme
+from nordlys.tagme.query import Query
+from nordlys.tagme.lucene_tools import Lucene
+from nordlys.storage.bloom import FilteredSurfaceForms
+
+
+class AnnotationRequest(object):
+    """A single text waiting to be annotated."""
+
+    def __init__(self, text, rho_th):
+        self.text = text
+        self.rho_th = rho_th
+        self.annotations = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class TagmeService(object):
+
+    def __init__(self, max_batch=64, max_wait=0.005):
+        """
+        :param max_batch: maximum number of texts annotated in a batch
+        :param max_wait: maximum time (in seconds) to wait for other requests before annotating a batch
+        """
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = Queue.Queue()
+        self.num_texts = 0
+        self.num_annotated = 0
+        self.num_batches = 0
+        self.__thread = None
+
+    def start(self):
+        """Opens the indices and starts the annotation thread."""
+        tagme.open_indices()
+        self.__thread = threading.Thread(target=self.__run, name="tagme-annotator")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def annotate(self, texts, rho_th=0):
+        """
+        Annotates texts; blocks until all of them are annotated.
+
+        :param texts: list of texts
+        :param rho_th: rho score threshold
+        :return: list of annotations for each text [[{"mention": men, "entity": en, "score": rho}, ...], ...]
+        """
+        requests = [AnnotationRequest(text, rho_th) for text in texts]
+        for request in requests:
+            self.queue.put(request)
+        for request in requests:
+            request.done.wait()
+            if request.error is not None:
+                raise Exception(request.error)
+        return [request.annotations for request in requests]
+
+    def stats(self):
+        """Returns service statistics."""
+        stats = {'texts': self.num_texts,
+                'annotated': self.num_annotated,
+                'batches': self.num_batches,
+                'queued': self.queue.qsize(),
+                'backend_calls': dict(instrument.COUNTERS),
+                'in_links_cache': tagme.IN_LINKS_CACHE.stats(),
+                'mw_rel_cache': tagme.MW_REL_CACHE.stats()}
+        if isinstance(config.SF_WIKI, FilteredSurfaceForms):
+            stats['sf_filter'] = config.SF_WIKI.stats()
+        return stats
+
+    def __run(self):
+        """Collects requests into batches and annotates them."""
+        Lucene.attach_current_thread()
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except Queue.Empty:
+                    break
+            try:
+                self.__annotate_batch(batch)
+            except Exception as e:
+                # e.g. the surface form dictionary is not reachable; requests of the batch get the error and the
+                # thread keeps serving the next batches
+                for request in batch:
+                    if not request.done.is_set():
+                        request.error = repr(e)
+                        request.done.set()
+
+    def __annotate_batch(self, batch):
+        """Annotates a batch of requests."""
+        # identical requests are annotated once
+        groups = {}
+        for request in batch:
+            groups.setdefault((request.text, request.rho_th), []).append(request)
+        queries = {}
+        for i, key in enumerate(groups):
+            queries[key] = Query(str(i), key[0])
+
+        # surface forms are looked up once for the whole batch
+        sf_matches = {}
+        tagme.lookup_surface_forms([ngram for query in queries.itervalues()
+                                    for ngram in tagme.get_mention_ngrams(query)], sf_matches)
+
+        for key, query in queries.iteritems():
+            annotations, error = None, None
+            try:
+                tagme_obj = Tagme(query, key[1], sf_matches=sf_matches)
+                linked_ens = tagme_obj.prune(tagme_obj.disambiguate(tagme_obj.parse()))
+                annotations = [{'mention': men, 'entity': en, 'score': score}
+                               for men, (en, score) in sorted(linked_ens.items())]
+            except Exception as e:
+                error = repr(e)
+            for request in groups[key]:
+                request.annotations = annotations
+                request.error = error
+                request.done.set()
+        self.num_texts += len(batch)
+        self.num_annotated += len(queries)
+        self.num_batches += 1
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """Handles HTTP requests of the service."""
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.__send(200, {'status': "ok"})
+        elif self.path == "/stats":
+            self.__send(200, self.server.service.stats())
+        else:
+            self.__send(404, {'error': "Unknown path " + self.path})
+
+    def do_POST(self):
+        if self.path != "/annotate":
+            self.__send(404, {'error': "Unknown path " + self.path})
+            return
+        try:
+            length = int(self.headers.getheader("content-length", 0))
+            params, texts, rho_th = self.parse_params(self.rfile.read(length))
+        except (ValueError, TypeError, AttributeError) as e:
+            self.__send(400, {'error': str(e)})
+            return
+
+        try:
+            results = self.server.service.annotate(texts, rho_th)
+        except Exception as e:
+            self.__send(500, {'error': str(e)})
+            return
+        if "texts" in params:
+            self.__send(200, {'results': [{'annotations': annotations} for annotations in results]})
+        else:
+            self.__send(200, {'annotations': results[0]})
+
+    @staticmethod
+    def parse_params(body):
+        """
+        Parses and validates the body of an annotation request.
+
+        :return: request parameters, list of texts, rho score threshold
+        :raises ValueError: if the request is malformed
+        """
+        params = json.loads(body)
+        if type(params) is not dict:
+            raise ValueError("Request should be a JSON object")
+        rho_th = params.get("threshold", 0)
+        if type(rho_th) not in (int, long, float):
+            raise ValueError("'threshold' should be a number")
+        if "texts" in params:
+            texts = params["texts"]
+        elif "text" in params:
+            texts = [params["text"]]
+        else:
+            raise ValueError("'text' or 'texts' is required")
+        if (type(texts) is not list) or any(not isinstance(text, basestring) for text in texts):
+            raise ValueError("Texts should be strings")
+        return params, texts, float(rho_th)
+
+    def __send(self, status, content):
+        body = json.dumps(content)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ServiceServer(ThreadingMixIn, HTTPServer):
+    """Multi-threaded HTTP server; annotation itself is done by the service thread."""
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        HTTPServer.__init__(self, address, ServiceHandler)
+        self.service = service
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-host", help="Host to bind to", default="127.0.0.1")
+    parser.add_argument("-port", help="Port to listen on", type=int, default=8090)
+    parser.add_argument("-batch", help="Maximum number of texts per batch", type=int, default=64)
+    parser.add_argument("-wait", help="Maximum wait time (ms) for filling a batch", type=float, default=5)
+    args = parser.parse_args()
+
+    service = TagmeService(max_batch=args.batch, max_wait=args.wait / 1000.0)
+    service.start()
+    server = ServiceServer((args.host, args.port), service)
+    print "TAGME service is listening on " + args.host + ":" + str(args.port)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Spots surface forms in queries using a sorted table of the surface forms in the dictionary.
+
+Instead of looking up all n-grams of a query, only the n-grams that exist in the dictionary (and can pass the
+mention filters of Tagme.parse()) are returned. The n-grams starting at each token are extended one token at a time
+(up to 6 words) and looked up by binary search; extending stops when no surface form starts with the n-gram.
+
+The table is stored in the same format as the surface forms of nordlys.storage.sfstore, and is memory-mapped, so it
+is loaded lazily by the OS and shared by all (forked) processes using the spotter:
+  - sfs.bin, sf_offsets.npy: Surface forms (utf-8), sorted; surface form i is sfs[sf_offsets[i]:sf_offsets[i+1]].
+
+The spotter is built offline:
+  python -m nordlys.tagme.spotter -collection surfaceforms_wiki_20100408 -output path/to/spotter
+
+@author: Faegheh Hasibi (faegheh.hasibi@idi.ntnu.no)
+"""
+
+import argparse
+import mmap
+import os
+import numpy as np
+from nordlys.storage.surfaceforms import SurfaceForms
+from nordlys.wikipedia.keyphraseness import is_candidate
+
+SFS_FILE = "sfs.bin"
+SF_OFFSETS_FILE = "sf_offsets.npy"
+
+
+class Spotter(object):
+    MAX_LEN = 6  # maximum number of words in a mention
+
+    def __init__(self, sfs, sf_offsets):
+        """
+        :param sfs: sorted surface forms, concatenated (string or memory-mapped file)
+        :param sf_offsets: offsets of the surface forms in sfs (one more than the number of surface forms)
+        """
+        self.sfs = sfs
+        self.sf_offsets = sf_offsets
+        self.num_sfs = len(sf_offsets) - 1
+
+    def get_surface_form(self, sf_id):
+        return self.sfs[int(self.sf_offsets[sf_id]):int(self.sf_offsets[sf_id + 1])]
+
+    def __lower_bound(self, s, lo=0):
+        """Returns the id of the first surface form that is not smaller than s."""
+        hi = self.num_sfs
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.get_surface_form(mid) < s:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def __lookup(self, ngram):
+        """
+        Looks up an n-gram.
+
+        :return: (the n-gram is a surface form, a longer surface form starts with the n-gram)
+        """
+        sf_id = self.__lower_bound(ngram)
+        found = (sf_id < self.num_sfs) and (self.get_surface_form(sf_id) == ngram)
+        prefix = ngram + " "
+        sf_id = self.__lower_bound(prefix, sf_id)
+        extendable = (sf_id < self.num_sfs) and self.get_surface_form(sf_id).startswith(prefix)
+        return found, extendable
+
+    def spot(self, tokens):
+        """
+        Finds all spans of the tokens that match a surface form.
+
+        :param tokens: list of tokens
+        :return: list of (start, end) spans, sorted by length and start position
+        """
+        tokens = [token.encode("utf-8") if type(token) is unicode else token for token in tokens]
+        spans = []
+        for start in range(0, len(tokens)):
+            for end in range(start, min(start + self.MAX_LEN, len(tokens))):
+                found, extendable = self.__lookup(" ".join(tokens[start:end + 1]))
+                if found:
+                    spans.append((start, end + 1))
+                if not extendable:
+                    break
+        return sorted(spans, key=lambda span: (span[1] - span[0], span[0]))
+
+    def get_ngrams(self, query):
+        """
+        Returns n-grams of the query that are surface forms; in the same order as Query.get_ngrams().
+
+        :param query: Query object
+        :return: list of n-grams
+        """
+        tokens = query.query.strip().split()
+        return [" ".join(tokens[start:end]) for start, end in self.spot(tokens)]
+
+    @staticmethod
+    def create(surface_forms):
+        """Creates an in-memory spotter from (lowercased) surface forms."""
+        sfs = sorted(set(" ".join(sf.split()) for sf in surface_forms))
+        sf_offsets = np.zeros(len(sfs) + 1, dtype=np.int64)
+        sf_offsets[1:] = np.cumsum([len(sf) for sf in sfs])
+        return Spotter("".join(sfs), sf_offsets)
+
+    def save(self, output_dir):
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        with open(os.path.join(output_dir, SFS_FILE), "wb") as f:
+            f.write(self.sfs[:])
+        np.save(os.path.join(output_dir, SF_OFFSETS_FILE), np.asarray(self.sf_offsets, dtype=np.int64))
+
+    @staticmethod
+    def load(spotter_dir):
+        """Memory-maps the spotter files."""
+        with open(os.path.join(spotter_dir, SFS_FILE), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                sfs = ""
+            else:
+                sfs = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        spotter = Spotter(sfs, np.load(os.path.join(spotter_dir, SF_OFFSETS_FILE), mmap_mode="r"))
+        print "Spotter loaded from " + spotter_dir + " (" + str(spotter.num_sfs) + " surface forms)"
+        return spotter
+
+    @staticmethod
+    def build(collection):
+        """
+        Builds the spotter from a surface form collection.
+
+        :param collection: name of the surface form collection
+        """
+        sf_dict = SurfaceForms(collection)
+        surface_forms = []
+        i = 0
+        for doc in sf_dict.mongo.find_all(fields=["anchor"]):
+            i += 1
+            if i % 1000000 == 0:
+                print "Processed", i, "th surface form!"
+            sf = doc["_id"].encode("utf-8") if type(doc["_id"]) is unicode else doc["_id"]
+            if is_candidate(sf, doc.get("anchor", {})):
+                surface_forms.append(sf)
+        print len(surface_forms), "surface forms (out of", i, ") are added to the spotter."
+        return Spotter.create(surface_forms)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-collection", help="Surface form collection (e.g. surfaceforms_wiki_20100408)")
+    parser.add_argument("-output", help="Path to the spotter directory")
+    args = parser.parse_args()
+
+    Spotter.build(args.collection).save(args.output)
+
+if __name__ == "__main__":
+    main()
@@ -6,40 +6,161 @@ TAGME implementation
 
 import argparse
 import math
+import os
+import threading
+from multiprocessing import Pool
+import numpy as np
 from nordlys.config import OUTPUT_DIR
 from nordlys.tagme import config
 from nordlys.tagme import test_coll
 from nordlys.tagme.query import Query
 from nordlys.tagme.mention import Mention
 from nordlys.tagme.lucene_tools import Lucene
-
-
-ENTITY_INDEX = Lucene(config.INDEX_PATH)
-ANNOT_INDEX = Lucene(config.INDEX_ANNOT_PATH, use_ram=True)
-
-# ENTITY_INDEX = IndexCache("/data/wikipedia-indices/20120502-index1")
-# ANNOT_INDEX = IndexCache("/data/wikipedia-indices/20120502-index1-annot/", use_ram=True)
-
-ENTITY_INDEX.open_searcher()
-ANNOT_INDEX.open_searcher()
+from nordlys.tagme.inlink_graph import InLinkGraph
+from nordlys.tagme.cache import LRUCache
+from nordlys.tagme.spotter import Spotter
+from nordlys.tagme import instrument
+from nordlys.tagme.instrument import QueryProfile
+from nordlys.storage.bloom import FilteredSurfaceForms
+
+
+# Indices are opened on first use (see get_entity_index(), get_annot_index(), ...), so importing this module does
+# not start the JVM; the JVM cannot be shared with forked worker processes either.
+ENTITY_INDEX = None
+ANNOT_INDEX = None
+INLINK_GRAPH = None
+SPOTTER = None
+SPOTTER_LOADED = False
+OPEN_LOCK = threading.Lock()
+
+# caches are kept for the lifetime of the process, so that they are shared between queries
+IN_LINKS_CACHE = LRUCache(config.IN_LINKS_CACHE_ITEMS, config.IN_LINKS_CACHE_MB)
+MW_REL_CACHE = LRUCache(config.MW_REL_CACHE_ITEMS, config.MW_REL_CACHE_MB)
+
+
+def get_entity_index():
+    """Returns the full-text Wikipedia index; opens it on first use."""
+    global ENTITY_INDEX
+    if ENTITY_INDEX is None:
+        with OPEN_LOCK:
+            if ENTITY_INDEX is None:
+                index = Lucene(config.INDEX_PATH, dir_mode=config.INDEX_DIR_MODE)
+                index.open_searcher()
+                ENTITY_INDEX = index
+    return ENTITY_INDEX
+
+
+def get_annot_index():
+    """Returns the annotation index (used for counting in-links); opens it on first use."""
+    global ANNOT_INDEX
+    if ANNOT_INDEX is None:
+        with OPEN_LOCK:
+            if ANNOT_INDEX is None:
+                index = Lucene(config.INDEX_ANNOT_PATH, dir_mode=config.INDEX_ANNOT_DIR_MODE)
+                index.open_searcher()
+                ANNOT_INDEX = index
+    return ANNOT_INDEX
+
+
+def get_inlink_graph():
+    """Returns the memory-mapped snapshot of the annotation index; loads it on first use."""
+    global INLINK_GRAPH
+    if INLINK_GRAPH is None:
+        with OPEN_LOCK:
+            if INLINK_GRAPH is None:
+                INLINK_GRAPH = InLinkGraph(config.INLINK_GRAPH_PATH)
+    return INLINK_GRAPH
+
+
+def get_spotter():
+    """Returns the spotter (None if config.SPOTTER_PATH is not set); loads it on first use."""
+    global SPOTTER, SPOTTER_LOADED
+    if not SPOTTER_LOADED:
+        with OPEN_LOCK:
+            if not SPOTTER_LOADED:
+                SPOTTER = Spotter.load(config.SPOTTER_PATH) if config.SPOTTER_PATH is not None else None
+                SPOTTER_LOADED = True
+    return SPOTTER
+
+
+def open_indices():
+    """Opens all indices used by Tagme at once; e.g. to warm up a process before annotating queries."""
+    get_entity_index()
+    # in-links are counted either from the annotation index or from its memory-mapped snapshot
+    if config.REL_BACKEND == "inlink_graph":
+        get_inlink_graph()
+    else:
+        get_annot_index()
+    get_spotter()
+
+
+def get_ngrams(query):
+    """Returns the n-grams of the query to be looked up; only the spotted ones if a spotter is loaded."""
+    spotter = get_spotter()
+    if spotter is not None:
+        return spotter.get_ngrams(query)
+    return query.get_ngrams()
+
+
+def get_mention_ngrams(query):
+    """
+    Returns the n-grams of the query that pass the length filters of mentions (based on the paper); only these are
+    looked up in the surface form dictionary.
+    """
+    return [ngram for ngram in get_ngrams(query)
+            if (len(ngram) != 1) and (not ngram.isdigit()) and (len(ngram.split()) <= 6)]
+
+
+def lookup_surface_forms(ngrams, sf_matches):
+    """
+    Looks up the surface form records of n-grams with a single (bulk) query to the surface form dictionary.
+
+    :param ngrams: list of n-grams
+    :param sf_matches: dictionary {ngram: record}, updated in place; n-grams already in it are not looked up again
+    """
+    missing = [ngram for ngram in set(ngrams) if ngram not in sf_matches]
+    if len(missing) == 0:
+        return
+    for ngram, matches in config.SF_WIKI.get_many(missing).iteritems():
+        sf_matches[ngram] = matches if matches is not None else {}
 
 
 class Tagme(object):
 
     DEBUG = 0
 
-    def __init__(self, query, rho_th, sf_source="wiki"):
+    def __init__(self, query, rho_th, sf_source="wiki", sf_matches=None):
+        """
+        :param query: Query object
+        :param rho_th: rho score threshold
+        :param sf_source: source of surface forms ("wiki" or "facc")
+        :param sf_matches: surface form records of n-grams that are already looked up {ngram: {source: {en: count}}}
+        """
         self.query = query
         self.rho_th = rho_th
         self.sf_source = sf_source
+        self.sf_matches = sf_matches if sf_matches is not None else {}
 
         # TAMGE params
         self.link_prob_th = 0.001
         self.cmn_th = 0.02
         self.k_th = 0.3
+        # candidate limits per mention (None for no limit)
+        self.max_candidates = config.MAX_CANDIDATES
+        self.max_zero_cmn = config.MAX_ZERO_CMN_CANDIDATES
+
+        # "loop" (pairwise votes) or "matrix" (votes from a relatedness matrix of all candidates)
+        self.disamb_engine = config.DISAMB_ENGINE
+        # skips votes for candidates that cannot be disambiguated ("loop" engine only)
+        self.disamb_pruning = config.DISAMB_PRUNING
+        # "full" (all mentions vote for each other) or "window" (only mentions within the window, in tokens)
+        self.coherence = config.COHERENCE
+        self.window = config.COHERENCE_WINDOW
 
         self.link_probs = {}
-        self.in_links = {}
+        self.men_positions = {}  # dictionary {men: [start_position, ...]}; only for windowed coherence
+        self.neighbours = None  # dictionary {men: set(mentions within the window)}; None for full coherence
+        self.__men_order = {}
         self.rel_scores = {}  # dictionary {men: {en: rel_score, ...}, ...}
         self.disamb_ens = {}
 
@@ -50,10 +171,13 @@ class Tagme(object):
         :return: candidate entities {men:{en:cmn, ...}, ...}
         """
         ens = {}
-        for ngram in self.query.get_ngrams():
-            mention = Mention(ngram)
-            # performs mention filtering (based on the paper)
-            if (len(ngram) == 1) or (ngram.isdigit()) or (mention.wiki_occurrences < 2) or (len(ngram.split()) > 6):
+        ngram_positions = self.query.get_ngram_positions(6) if self.coherence == "window" else {}
+        # performs mention filtering (based on the paper); n-grams that pass the length filters are looked up at once
+        ngrams = get_mention_ngrams(self.query)
+        lookup_surface_forms(ngrams, self.sf_matches)
+        for ngram in ngrams:
+            mention = Mention(ngram, self.sf_matches[ngram])
+            if mention.wiki_occurrences < 2:
                 continue
             link_prob = self.__get_link_prob(mention)
             if link_prob < self.link_prob_th:
@@ -62,7 +186,7 @@ class Tagme(object):
             self.link_probs[ngram] = link_prob
             # Filters entities by cmn threshold 0.001; this was only in TAGME source code and speeds up the process.
             # TAGME source code: it.acubelab.tagme.anchor (lines 279-284)
-            ens[ngram] = mention.get_men_candidate_ens(0.001)
+            ens[ngram] = mention.get_men_candidate_ens(0.001, self.max_candidates, self.max_zero_cmn)
 
         # filters containment mentions (based on paper)
         candidate_entities = {}
@@ -77,6 +201,8 @@ class Tagme(object):
                     break
             if not ignore_m_i:
                 candidate_entities[m_i] = ens[m_i]
+                if self.coherence == "window":
+                    self.men_positions[m_i] = ngram_positions[m_i]
         return candidate_entities
 
     def disambiguate(self, candidate_entities):
@@ -86,17 +212,25 @@ class Tagme(object):
         :param candidate_entities: {men:{en:cmn, ...}, ...}
         :return: disambiguated entities {men:en, ...}
         """
+        self.neighbours = self.__get_neighbours(candidate_entities.keys())
+        if self.disamb_engine == "matrix":
+            return self.__disambiguate_matrix(candidate_entities)
+
         # Gets the relevance score
         rel_scores = {}
         for m_i in candidate_entities.keys():
             if self.DEBUG:
                 print "********************", m_i, "********************"
+            voters = self.__get_voters(m_i, candidate_entities.keys())
+            if self.disamb_pruning:
+                rel_scores[m_i] = self.__calc_rel_scores_pruned(m_i, candidate_entities, voters)
+                continue
             rel_scores[m_i] = {}
             for e_m_i in candidate_entities[m_i].keys():
                 if self.DEBUG:
                     print "-- ", e_m_i
                 rel_scores[m_i][e_m_i] = 0
-                for m_j in candidate_entities.keys():  # all other mentions
+                for m_j in voters:  # all other mentions
                     if (m_i == m_j) or (len(candidate_entities[m_j].keys()) == 0):
                         continue
                     vote_e_m_j = self.__get_vote(e_m_i, candidate_entities[m_j])
@@ -105,14 +239,7 @@ class Tagme(object):
                         print m_j, vote_e_m_j
 
         # pruning uncommon entities (based on the paper)
-        self.rel_scores = {}
-        for m_i in rel_scores:
-            for e_m_i in rel_scores[m_i]:
-                cmn = candidate_entities[m_i][e_m_i]
-                if cmn >= self.cmn_th:
-                    if m_i not in self.rel_scores:
-                        self.rel_scores[m_i] = {}
-                    self.rel_scores[m_i][e_m_i] = rel_scores[m_i][e_m_i]
+        self.rel_scores = self.__filter_uncommon(candidate_entities, rel_scores)
 
         # DT pruning
         disamb_ens = {}
@@ -131,6 +258,185 @@ class Tagme(object):
 
         return disamb_ens
 
+    def __calc_rel_scores_pruned(self, men, candidate_entities, voters):
+        """
+        Computes rel scores of the candidates of a mention, where votes are only computed as long as a candidate can
+        be among the top-k entities (see __get_top_k).
+          - Candidates with commonness below the threshold get no votes (they are filtered out afterwards).
+          - Votes are added round-robin (one voter at a time, for all candidates); as mw_rel <= 1, the remaining
+            votes of a candidate are bounded by the average commonness of the remaining voters. A candidate is
+            dropped if there are k other candidates with disjoint score intervals above its upper bound, i.e. k
+            distinct rel scores are higher than its score.
+        Scores of the other candidates are summed up in the same order as in disambiguate(), so the disambiguated
+        entities are the same.
+
+        :param men: mention
+        :param candidate_entities: {men:{en:cmn, ...}, ...}
+        :param voters: voting mentions
+        :return: {en: rel_score, ...}; for dropped candidates, the score is a lower bound
+        """
+        voters = [m_j for m_j in voters if (m_j != men) and (len(candidate_entities[m_j].keys()) > 0)]
+        # keys are added in the same order as in disambiguate(), so that ties are broken in the same way
+        rel_scores = {}
+        ens = []
+        for en, cmn in candidate_entities[men].iteritems():
+            rel_scores[en] = 0
+            if cmn >= self.cmn_th:
+                ens.append(en)
+        k = int(round(len(ens) * self.k_th))
+        k = 1 if k == 0 else k
+
+        # maximum vote of each voter (computed in the same order as __get_vote, so it is not exceeded by rounding)
+        max_votes = []
+        for m_j in voters:
+            max_vote = 0
+            for cmn in candidate_entities[m_j].itervalues():
+                max_vote += cmn
+            max_votes.append(max_vote / float(len(candidate_entities[m_j])))
+
+        active = list(ens)
+        upper_bounds = {}
+        for r, m_j in enumerate(voters):
+            for en in active:
+                rel_scores[en] += self.__get_vote(en, candidate_entities[m_j])
+            if (len(ens) <= k) or (r == len(voters) - 1):
+                continue
+            for en in active:
+                upper_bound = rel_scores[en]
+                for max_vote in max_votes[r + 1:]:
+                    upper_bound += max_vote
+                upper_bounds[en] = upper_bound
+            active = [en for en in active if not self.__is_hopeless(en, ens, rel_scores, upper_bounds, k)]
+        return rel_scores
+
+    @staticmethod
+    def __is_hopeless(en, ens, lower_bounds, upper_bounds, k):
+        """Checks if there are k disjoint score intervals of other candidates above the upper bound of a candidate."""
+        above = sorted((upper_bounds[e], lower_bounds[e]) for e in ens
+                       if (e != en) and (lower_bounds[e] > upper_bounds[en]))
+        count, last_upper = 0, None
+        for upper, lower in above:  # greedy selection of disjoint intervals
+            if (last_upper is None) or (lower > last_upper):
+                count += 1
+                last_upper = upper
+                if count >= k:
+                    return True
+        return False
+
+    def __disambiguate_matrix(self, candidate_entities):
+        """
+        Performs disambiguation using a relatedness matrix of all candidate entities.
+        Gives exactly the same output as disambiguate() with the "loop" engine, as votes and rel scores are
+        summed up in the same order (sequential cumulative sums). With pruning, rel scores (and the relatedness
+        they need) are not computed for candidates below the commonness threshold; the upper-bound pruning of the
+        "loop" engine is not applied, as all votes are computed at once.
+
+        :param candidate_entities: {men:{en:cmn, ...}, ...}
+        :return: disambiguated entities {men:en, ...}
+        """
+        mentions = candidate_entities.keys()
+        rel_scores = {}
+        for m_i in mentions:
+            rel_scores[m_i] = {}
+        if self.neighbours is None:
+            self.__calc_rel_scores_matrix(candidate_entities, mentions, range(len(mentions)), rel_scores)
+        else:
+            # each mention gets votes only from its neighbours; one (small) matrix per mention
+            for m_i in mentions:
+                voters = self.__get_voters(m_i, mentions)
+                self.__calc_rel_scores_matrix(candidate_entities, [m_i] + voters, [0], rel_scores)
+
+        # pruning uncommon entities (based on the paper)
+        self.rel_scores = self.__filter_uncommon(candidate_entities, rel_scores)
+
+        # DT pruning
+        disamb_ens = {}
+        for m_i in self.rel_scores:
+            if len(self.rel_scores[m_i].keys()) == 0:
+                continue
+            ens, scores = zip(*self.rel_scores[m_i].items())
+            top_k = self.__get_top_k_indices(np.array(scores, dtype=float))
+            # the last entity with the highest commonness among top-k entities (sorted by rel score)
+            top_k_cmns = np.array([candidate_entities[m_i][ens[t]] for t in top_k], dtype=float)
+            best = len(top_k) - 1 - int(np.argmax(top_k_cmns[::-1]))
+            disamb_ens[m_i] = ens[top_k[best]]
+
+        return disamb_ens
+
+    def __calc_rel_scores_matrix(self, candidate_entities, mentions, targets, rel_scores):
+        """
+        Computes rel scores for the candidates of target mentions, where all the given mentions vote for each other.
+
+        :param candidate_entities: {men:{en:cmn, ...}, ...}
+        :param mentions: list of mentions; voters are summed up in this order
+        :param targets: indices of the mentions (in the mentions list) to compute rel scores for
+        :param rel_scores: {men: {en: rel_score, ...}, ...}; rel scores of target candidates are added to it
+            (with pruning, only for the candidates with commonness above the threshold)
+        """
+        # one column per candidate, in the same order as candidates are iterated in the "loop" engine
+        col_mens, col_ens, col_cmns, blocks = [], [], [], []
+        for i, m_i in enumerate(mentions):
+            start = len(col_ens)
+            for en, cmn in candidate_entities[m_i].iteritems():
+                col_mens.append(i)
+                col_ens.append(en)
+                col_cmns.append(cmn)
+            blocks.append((start, len(col_ens)))
+        is_target = np.zeros(len(mentions), dtype=bool)
+        is_target[targets] = True
+        target_cols = [c for c in range(len(col_ens)) if is_target[col_mens[c]] and
+                       ((not self.disamb_pruning) or (col_cmns[c] >= self.cmn_th))]
+        # keys of all target candidates are added in the same order as in the "loop" engine (also the pruned ones),
+        # so that ties are broken in the same way
+        for c in range(len(col_ens)):
+            if is_target[col_mens[c]]:
+                rel_scores[mentions[col_mens[c]]][col_ens[c]] = 0
+        if len(target_cols) == 0:
+            return
+
+        # voters[i, j]: mention j votes for the candidates of mention i
+        voters = np.ones((len(mentions), len(mentions))) - np.eye(len(mentions))
+        # relatedness is computed once for each pair of distinct entities, where one votes for the other
+        en_ids = {}
+        col_en_ids = [en_ids.setdefault(en if self.sf_source == "wiki" else en[0], len(en_ids)) for en in col_ens]
+        unique_ens = sorted(en_ids, key=en_ids.get)
+        incidence = np.zeros((len(unique_ens), len(mentions)))
+        incidence[col_en_ids, col_mens] = 1
+        target_incidence = np.zeros((len(unique_ens), len(mentions)))
+        target_incidence[[col_en_ids[c] for c in target_cols], [col_mens[c] for c in target_cols]] = 1
+        needed = target_incidence.dot(voters).dot(incidence.T) > 0
+        rel = self.__get_rel_matrix(unique_ens, needed | needed.T)[col_en_ids][:, col_en_ids]
+        weighted_rel = rel[target_cols] * np.array(col_cmns, dtype=float)
+
+        # votes[c, j]: vote of mention j for target candidate c
+        votes = np.zeros((len(target_cols), len(mentions)))
+        for j, (start, end) in enumerate(blocks):
+            if start == end:
+                continue
+            votes[:, j] = np.cumsum(weighted_rel[:, start:end], axis=1)[:, -1] / float(end - start)
+        votes *= voters[[col_mens[c] for c in target_cols]]
+        target_rel_scores = np.cumsum(votes, axis=1)[:, -1]
+        for t, c in enumerate(target_cols):
+            rel_scores[mentions[col_mens[c]]][col_ens[c]] = float(target_rel_scores[t])
+
+    def __filter_uncommon(self, candidate_entities, rel_scores):
+        """
+        Removes entities with commonness below the threshold.
+
+        :param candidate_entities: {men:{en:cmn, ...}, ...}
+        :param rel_scores: {men: {en: rel_score, ...}, ...}
+        :return: {men: {en: rel_score, ...}, ...}
+        """
+        filtered_rel_scores = {}
+        for m_i in rel_scores:
+            for e_m_i in rel_scores[m_i]:
+                cmn = candidate_entities[m_i][e_m_i]
+                if cmn >= self.cmn_th:
+                    if m_i not in filtered_rel_scores:
+                        filtered_rel_scores[m_i] = {}
+                    filtered_rel_scores[m_i][e_m_i] = rel_scores[m_i][e_m_i]
+        return filtered_rel_scores
+
     def prune(self, dismab_ens):
         """
         Performs AVG pruning.
@@ -138,22 +444,123 @@ class Tagme(object):
         :param dismab_ens: {men: en, ... }
         :return: {men: (en, score), ...}
         """
+        if self.disamb_engine == "matrix":
+            return self.__prune_matrix(dismab_ens)
+
+        # in window mode, neighbours are visited in the order of dismab_ens, as in full coherence
+        dismab_order = {men: i for i, men in enumerate(dismab_ens)} if self.neighbours is not None else None
         linked_ens = {}
         for men, en in dismab_ens.iteritems():
-            coh_score = self.__get_coherence_score(men, en, dismab_ens)
+            coh_score = self.__get_coherence_score(men, en, dismab_ens, dismab_order)
             rho_score = (self.link_probs[men] + coh_score) / 2.0
             if rho_score >= self.rho_th:
                 linked_ens[men] = (en, rho_score)
         return linked_ens
 
+    def __prune_matrix(self, dismab_ens):
+        """
+        Performs AVG pruning, where coherence scores are computed from the relatedness matrix of linked entities.
+        In window mode, one (small) matrix is computed per mention and its neighbours.
+
+        :param dismab_ens: {men: en, ... }
+        :return: {men: (en, score), ...}
+        """
+        linked_ens = {}
+        if len(dismab_ens) == 0:
+            return linked_ens
+        mens, ens = zip(*dismab_ens.items())
+        if self.neighbours is None:
+            others = np.ones((len(mens), len(mens))) - np.eye(len(mens))
+            rel = self.__get_rel_matrix(ens, others > 0)
+            coh_scores = np.cumsum(rel * others, axis=1)[:, -1]
+            num_others = others.sum(axis=1)
+            coh_scores[num_others > 0] /= num_others[num_others > 0]
+        else:
+            men_order = {men: i for i, men in enumerate(mens)}
+            coh_scores = np.zeros(len(mens))
+            for i, men in enumerate(mens):
+                # neighbours are summed up in the order of mens, as in full coherence
+                others = sorted([m_j for m_j in self.neighbours[men] if m_j in dismab_ens], key=men_order.get)
+                if len(others) == 0:
+                    continue
+                needed = np.zeros((len(others) + 1, len(others) + 1), dtype=bool)
+                needed[0, 1:] = True
+                rel = self.__get_rel_matrix([ens[i]] + [dismab_ens[m_j] for m_j in others], needed)
+                coh_scores[i] = np.cumsum(rel[0, 1:])[-1] / float(len(others))
+        for i, men in enumerate(mens):
+            rho_score = (self.link_probs[men] + float(coh_scores[i])) / 2.0
+            if rho_score >= self.rho_th:
+                linked_ens[men] = (ens[i], rho_score)
+        return linked_ens
+
+    def __get_neighbours(self, mentions):
+        """
+        Finds the mentions that are within the coherence window of each mention.
+        Two mentions are neighbours if the distance (in tokens) between any of their occurrences is at most the window.
+
+        :param mentions: list of mentions
+        :return: {men: set(mentions), ...}; None for full coherence
+        """
+        if self.coherence != "window":
+            return None
+        occurrences = sorted([(start, start + len(men.split()), men)
+                              for men in mentions for start in self.men_positions[men]])
+        self.__men_order = {men: i for i, men in enumerate(mentions)}
+        neighbours = {}
+        for men in mentions:
+            neighbours[men] = set()
+        for i in range(0, len(occurrences)):
+            _, end_i, m_i = occurrences[i]
+            for j in range(i + 1, len(occurrences)):
+                start_j, _, m_j = occurrences[j]
+                if start_j - end_i > self.window:
+                    break
+                if m_i != m_j:
+                    neighbours[m_i].add(m_j)
+                    neighbours[m_j].add(m_i)
+        return neighbours
+
+    def __get_voters(self, men, mentions):
+        """
+        Returns the mentions voting for the given mention, in the same order as in the mentions list.
+
+        :param men: mention
+        :param mentions: list of all mentions
+        """
+        if self.neighbours is None:
+            return [m for m in mentions if m != men]
+        return sorted(self.neighbours[men], key=self.__men_order.get)
+
+    def __get_rel_matrix(self, ens, needed):
+        """
+        Computes the relatedness matrix of entities.
+
+        :param ens: list of entities
+        :param needed: boolean matrix; relatedness is only computed for the marked pairs and is 0 for others
+        :return: symmetric matrix with relatedness scores (and 1 on the diagonal)
+        """
+        rel = np.zeros((len(ens), len(ens)))
+        for a, b in zip(*np.nonzero(np.triu(needed, 1))):
+            rel[a, b] = rel[b, a] = self.__get_mw_rel(ens[a], ens[b])
+        np.fill_diagonal(rel, 1.0)
+        return rel
+
     def __get_link_prob(self, mention):
         """
         Gets link probability for the given mention.
         Here, in fact, we are computing key-phraseness.
         """
 
-        pq = ENTITY_INDEX.get_phrase_query(mention.text, Lucene.FIELDNAME_CONTENTS)
-        mention_freq = ENTITY_INDEX.searcher.search(pq, 1).totalHits
+        # uses the precomputed frequency (see nordlys.wikipedia.keyphraseness), if available
+        mention_freq = mention.mention_freq
+        if mention_freq is None:
+            entity_index = get_entity_index()
+            if config.LINK_PROB_SOURCE == "shingles":
+                mention_freq = entity_index.get_ngram_freq(mention.text)
+            else:
+                pq = entity_index.get_phrase_query(mention.text, Lucene.FIELDNAME_CONTENTS)
+                mention_freq = entity_index.count(pq)
+            instrument.count(instrument.LUCENE_SEARCHES)
         if mention_freq == 0:
             return 0
         if self.sf_source == "wiki":
@@ -192,6 +599,14 @@ class Tagme(object):
         if e1 == e2:  # to speed-up
             return 1.0
         en_uris = tuple(sorted({e1, e2}))
+        rel = MW_REL_CACHE.get(en_uris)
+        if rel is None:
+            rel = self.__calc_mw_rel(en_uris)
+            MW_REL_CACHE.put(en_uris, rel)
+        return rel
+
+    def __calc_mw_rel(self, en_uris):
+        """Calculates Milne & Witten relatedness for a sorted pair of entities."""
         ens_in_links = [self.__get_in_links([en_uri]) for en_uri in en_uris]
         if min(ens_in_links) == 0:
             return 0
@@ -199,7 +614,11 @@ class Tagme(object):
         if conj == 0:
             return 0
         numerator = math.log(max(ens_in_links)) - math.log(conj)
-        denominator = math.log(ANNOT_INDEX.num_docs()) - math.log(min(ens_in_links))
+        if config.REL_BACKEND == "inlink_graph":
+            num_docs = get_inlink_graph().num_docs()
+        else:
+            num_docs = get_annot_index().num_docs()
+        denominator = math.log(num_docs) - math.log(min(ens_in_links))
         rel = 1 - (numerator / denominator)
         if rel < 0:
             return 0
@@ -212,29 +631,46 @@ class Tagme(object):
         :param en_uris: list of dbp_uris
         """
         en_uris = tuple(sorted(set(en_uris)))
-        if en_uris in self.in_links:
-            return self.in_links[en_uris]
-
-        term_queries = []
-        for en_uri in en_uris:
-            term_queries.append(ANNOT_INDEX.get_id_lookup_query(en_uri, Lucene.FIELDNAME_CONTENTS))
-        and_query = ANNOT_INDEX.get_and_query(term_queries)
-        self.in_links[en_uris] = ANNOT_INDEX.searcher.search(and_query, 1).totalHits
-        return self.in_links[en_uris]
-
-    def __get_coherence_score(self, men, en, dismab_ens):
+        in_links = IN_LINKS_CACHE.get(en_uris)
+        if in_links is not None:
+            return in_links
+
+        if config.REL_BACKEND == "inlink_graph":
+            in_links = get_inlink_graph().count_in_links(en_uris)
+            instrument.count(instrument.GRAPH_LOOKUPS)
+        else:
+            annot_index = get_annot_index()
+            term_queries = []
+            for en_uri in en_uris:
+                term_queries.append(annot_index.get_id_lookup_query(en_uri, Lucene.FIELDNAME_CONTENTS))
+            and_query = annot_index.get_and_query(term_queries)
+            in_links = annot_index.count(and_query)
+            instrument.count(instrument.LUCENE_SEARCHES)
+        IN_LINKS_CACHE.put(en_uris, in_links)
+        return in_links
+
+    def __get_coherence_score(self, men, en, dismab_ens, dismab_order=None):
         """
         coherence_score = sum_e_i(rel(e_i, en)) / len(ens) - 1
 
         :param en: entity
         :param dismab_ens: {men:  (dbp_uri, fb_id), ....}
+        :param dismab_order: {men: position in dismab_ens}; needed for windowed coherence
         """
         coh_score = 0
-        for m_i, e_i in dismab_ens.iteritems():
+        num_others = 0
+        if self.neighbours is None:
+            others = dismab_ens.iteritems()
+        else:
+            # windowed coherence: only mentions within the window are considered
+            others = [(m_i, dismab_ens[m_i]) for m_i in sorted([m_j for m_j in self.neighbours[men]
+                                                                if m_j in dismab_ens], key=dismab_order.get)]
+        for m_i, e_i in others:
             if m_i == men:
                 continue
             coh_score += self.__get_mw_rel(e_i, en)
-        coh_score = coh_score / float(len(dismab_ens.keys()) - 1) if len(dismab_ens.keys()) - 1 != 0 else 0
+            num_others += 1
+        coh_score = coh_score / float(num_others) if num_others != 0 else 0
         return coh_score
 
     def __get_top_k(self, mention):
@@ -254,13 +690,97 @@ class Tagme(object):
             prev_rel_score = rel_score
         return top_k_ens
 
+    def __get_top_k_indices(self, rel_scores):
+        """
+        Returns top-k percent of the entities based on rel score (see __get_top_k).
+
+        :param rel_scores: array of rel scores
+        :return: indices of top-k entities, sorted by rel score (ties keep their original order)
+        """
+        k = int(round(len(rel_scores) * self.k_th))
+        k = 1 if k == 0 else k
+        order = np.argsort(-rel_scores, kind="mergesort")
+        sorted_scores = rel_scores[order]
+        ranks = np.cumsum(np.concatenate(([1], sorted_scores[1:] != sorted_scores[:-1])))
+        return order[ranks <= k]
+
+
+def to_str(qid, linked_ens):
+    """
+    Output format:
+    qid, score, wiki-uri, mention, page-id
+    """
+    out_str = ""
+    for men, (en, score) in linked_ens.iteritems():
+        out_str += str(qid) + "\t" + str(score) + "\t" + en + "\t" + men + "\tpage-id" + "\n"
+    return out_str
+
+
+def init_worker():
+    """Opens indices and a new MongoDB connection in a worker process."""
+    open_indices()
+    config.SF_WIKI.reconnect()
+
+
+def annotate(qid, query, rho_th, verbose=False):
+    """
+    Annotates a single query and profiles it.
+
+    :return: linked entities {men: (en, score), ...} and the query profile
+    """
+    profile = QueryProfile(qid, {'in_links_cache': IN_LINKS_CACHE, 'mw_rel_cache': MW_REL_CACHE})
+    tagme = Tagme(Query(qid, query), rho_th)
+    if verbose:
+        print "  parsing ..."
+    with profile.stage("parse"):
+        cand_ens = tagme.parse()
+    if verbose:
+        print "  disambiguation ..."
+    with profile.stage("disambiguate"):
+        disamb_ens = tagme.disambiguate(cand_ens)
+    if verbose:
+        print "  pruning ..."
+    with profile.stage("prune"):
+        linked_ens = tagme.prune(disamb_ens)
+    profile_dict = profile.to_dict()
+    profile_dict['candidates'] = sum(len(ens) for ens in cand_ens.itervalues())
+    return linked_ens, profile_dict
+
+
+def annotate_query(job):
+    """
+    Annotates a single query in a worker process.
+
+    :param job: (qid, query, rho_th)
+    :return: (qid, output string, query profile)
+    """
+    qid, query, rho_th = job
+    linked_ens, profile = annotate(qid, query, rho_th)
+    return qid, to_str(qid, linked_ens), profile
+
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-th", "--threshold", help="score threshold", type=float, default=0)
     parser.add_argument("-data", help="Data set name", choices=['y-erd', 'erd-dev', 'wiki-annot30', 'wiki-disamb30'])
+    parser.add_argument("-w", "--workers", help="Number of worker processes", type=int, default=1)
+    parser.add_argument("-coherence", help="Full or windowed coherence", choices=['full', 'window'],
+                        default=config.COHERENCE)
+    parser.add_argument("-window", help="Coherence window (in tokens)", type=int, default=config.COHERENCE_WINDOW)
+    parser.add_argument("-maxcands", help="Top-N candidates (by commonness) per mention", type=int,
+                        default=config.MAX_CANDIDATES)
+    parser.add_argument("-maxzero", help="Maximum number of zero-commonness candidates per mention", type=int,
+                        default=config.MAX_ZERO_CMN_CANDIDATES)
+    parser.add_argument("-profile", help="Writes query profiles (JSON lines) next to the run file",
+                        action="store_true", default=False)
     args = parser.parse_args()
 
+    # Tagme objects (also in worker processes) take their settings from config
+    config.COHERENCE = args.coherence
+    config.COHERENCE_WINDOW = args.window
+    config.MAX_CANDIDATES = args.maxcands
+    config.MAX_ZERO_CMN_CANDIDATES = args.maxzero
+
     if args.data == "erd-dev":
         queries = test_coll.read_erd_queries()
     elif args.data == "y-erd":
@@ -274,25 +794,45 @@ def main():
     open(out_file_name, "w").close()
     out_file = open(out_file_name, "a")
 
-    # process the queries
-    for qid, query in sorted(queries.items(), key=lambda item: int(item[0]) if item[0].isdigit() else item[0]):
-        print "[" + qid + "]", query
-        tagme = Tagme(Query(qid, query), args.threshold)
-        print "  parsing ..."
-        cand_ens = tagme.parse()
-        print "  disambiguation ..."
-        disamb_ens = tagme.disambiguate(cand_ens)
-        print "  pruning ..."
-        linked_ens = tagme.prune(disamb_ens)
-
-        out_str = ""
-        for men, (en, score) in linked_ens.iteritems():
-            out_str += str(qid) + "\t" + str(score) + "\t" + en + "\t" + men + "\tpage-id" + "\n"
-        print out_str, "-----------\n"
-        out_file.write(out_str)
+    sorted_queries = sorted(queries.items(), key=lambda item: int(item[0]) if item[0].isdigit() else item[0])
+    profiles = []
+
+    # process the queries in parallel; results are written in the same (qid) order as in the serial mode
+    if args.workers > 1:
+        pool = Pool(args.workers, initializer=init_worker)
+        jobs = ((qid, query, args.threshold) for qid, query in sorted_queries)
+        for i, (qid, out_str, profile) in enumerate(pool.imap(annotate_query, jobs, chunksize=10)):
+            out_file.write(out_str)
+            profiles.append(profile)
+            if (i + 1) % 100 == 0:
+                print i + 1, "th query processed (qid: " + qid + ")"
+        pool.close()
+        pool.join()
 
+    # process the queries
+    else:
+        open_indices()
+        for qid, query in sorted_queries:
+            print "[" + qid + "]", query
+            linked_ens, profile = annotate(qid, query, args.threshold, verbose=True)
+            profiles.append(profile)
+
+            out_str = to_str(qid, linked_ens)
+            print out_str, "-----------\n"
+            out_file.write(out_str)
+        print "in-links cache:", IN_LINKS_CACHE.stats()
+        print "relatedness cache:", MW_REL_CACHE.stats()
+        if isinstance(config.SF_WIKI, FilteredSurfaceForms):
+            print "surface form filter:", config.SF_WIKI.stats()
+
+    out_file.close()
     print "output:", out_file_name
+    if args.profile:
+        profile_file_name = os.path.splitext(out_file_name)[0] + ".profile.jsonl"
+        instrument.write_profiles(profiles, profile_file_name)
+        print "profiles:", profile_file_name
+    print "\n" + instrument.summarize(profiles)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
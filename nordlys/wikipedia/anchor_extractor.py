@@ -1,10 +1,22 @@
 """
 Creates a single anchor file for all entity-linking annotations.
 
+Anchors are counted in parallel, directly from the annotation (.tsv) files: each worker process counts the
+anchor-entity pairs of its files and spills them to sorted run files whenever its memory budget is reached.
+The runs are then merge-sorted into anchors_count.txt.
+
 @author: Faegheh Hasibi (faegheh.hasibi@idi.ntnu.no)
 """
 import argparse
+import heapq
 import os
+import shutil
+from multiprocessing import Pool, cpu_count
+
+# rough memory usage of a counted anchor-entity pair (in bytes); used for converting the memory budget
+BYTES_PER_PAIR = 250
+# maximum number of run files merged at once
+MAX_RUNS = 256
 
 
 def merge_anchors(basedir, outfile):
@@ -44,24 +56,132 @@ def count_anchors(anchor_file, out_file):
         if i % 1000000 == 0:
             print i, "th line processed!"
 
-    out_str = ""
+    out = open(out_file, "w")
     for sf, en_counts in sf_dict.iteritems():
         for en, count in en_counts.iteritems():
-            out_str += sf + "\t" + en + "\t" + str(count) + "\n"
-    out = open(out_file, "w")
-    out.write(out_str)
+            out.write(sf + "\t" + en + "\t" + str(count) + "\n")
     out.close()
 
 
+def get_tsv_files(basedir):
+    """Returns all annotation (.tsv) files of the directory (recursively)."""
+    tsv_files = []
+    for path, dirs, files in os.walk(basedir):
+        for fn in sorted(files):
+            if fn.endswith(".tsv"):
+                tsv_files.append(os.path.join(path, fn))
+    return sorted(tsv_files)
+
+
+def write_run(pair_counts, run_file):
+    """Writes anchor-entity counts to a run file, sorted by anchor and entity."""
+    with open(run_file, "w") as out:
+        for (sf, en), count in sorted(pair_counts.iteritems()):
+            out.write(sf + "\t" + en + "\t" + str(count) + "\n")
+
+
+def read_run(run_file):
+    """Generates (anchor, entity, count) from a run file."""
+    with open(run_file, "r") as f:
+        for line in f:
+            sf, en, count = line.rstrip("\n").split("\t")
+            yield sf, en, int(count)
+
+
+def count_files(job):
+    """
+    Counts the anchor-entity pairs of annotation files; counts are spilled to sorted run files.
+
+    :param job: (worker id, list of .tsv files, run directory, maximum number of pairs kept in memory)
+    :return: list of run files
+    """
+    worker_id, tsv_files, run_dir, max_pairs = job
+    run_files = []
+    pair_counts = {}
+    for tsv_file in tsv_files:
+        with open(tsv_file, "r") as in_file:
+            for line in in_file:
+                cols = line.strip().split("\t")
+                if (len(cols) < 4) or (cols[2].strip().lower() == ""):
+                    continue
+                pair = (cols[2].strip().lower(), cols[3].strip())
+                pair_counts[pair] = pair_counts.get(pair, 0) + 1
+                if len(pair_counts) >= max_pairs:
+                    run_files.append(os.path.join(run_dir, "run_%03d_%05d.tsv" % (worker_id, len(run_files))))
+                    write_run(pair_counts, run_files[-1])
+                    pair_counts = {}
+    if len(pair_counts) > 0:
+        run_files.append(os.path.join(run_dir, "run_%03d_%05d.tsv" % (worker_id, len(run_files))))
+        write_run(pair_counts, run_files[-1])
+    return run_files
+
+
+def merge_runs(run_files, out_file):
+    """Merge-sorts run files and sums the counts of the same anchor-entity pairs; the output is written as a stream."""
+    with open(out_file, "w") as out:
+        prev_sf, prev_en, total = None, None, 0
+        for sf, en, count in heapq.merge(*[read_run(run_file) for run_file in run_files]):
+            if (sf != prev_sf) or (en != prev_en):
+                if prev_sf is not None:
+                    out.write(prev_sf + "\t" + prev_en + "\t" + str(total) + "\n")
+                prev_sf, prev_en, total = sf, en, 0
+            total += count
+        if prev_sf is not None:
+            out.write(prev_sf + "\t" + prev_en + "\t" + str(total) + "\n")
+
+
+def count_anchors_parallel(basedir, out_file, num_workers, memory_mb=1024):
+    """
+    Counts anchor-entity pairs of all annotation files, without merging them into a single file.
+
+    :param basedir: directory of annotation (.tsv) files
+    :param out_file: anchor count file (anchor, entity, count), sorted by anchor and entity
+    :param num_workers: number of worker processes
+    :param memory_mb: memory budget of each worker (in MB)
+    """
+    run_dir = out_file + ".runs"
+    if not os.path.exists(run_dir):
+        os.makedirs(run_dir)
+    tsv_files = get_tsv_files(basedir)
+    max_pairs = max(1, memory_mb * 1024 * 1024 / BYTES_PER_PAIR)
+    jobs = [(i, tsv_files[i::num_workers], run_dir, max_pairs) for i in range(num_workers)]
+    pool = Pool(num_workers)
+    run_files = [run_file for worker_runs in pool.map(count_files, jobs) for run_file in worker_runs]
+    pool.close()
+    pool.join()
+    print len(tsv_files), "files are counted into", len(run_files), "runs."
+
+    # runs are merged in multiple passes, if there are too many of them to be opened at once
+    level = 0
+    while len(run_files) > MAX_RUNS:
+        merged_runs = []
+        for i in range(0, len(run_files), MAX_RUNS):
+            merged_runs.append(os.path.join(run_dir, "merged_%02d_%05d.tsv" % (level, len(merged_runs))))
+            merge_runs(run_files[i:i + MAX_RUNS], merged_runs[-1])
+            for run_file in run_files[i:i + MAX_RUNS]:
+                os.remove(run_file)
+        run_files = merged_runs
+        level += 1
+    merge_runs(run_files, out_file)
+    shutil.rmtree(run_dir)
+
+
 def main():
     # Builds anchor file
     parser = argparse.ArgumentParser()
     parser.add_argument("-inputdir", help="Path to directory to read from")
     parser.add_argument("-outputdir", help="Path to write the annotations (.tsv files)")
+    parser.add_argument("-workers", help="Number of worker processes", type=int, default=cpu_count())
+    parser.add_argument("-mem", help="Memory budget of each worker (MB)", type=int, default=1024)
+    parser.add_argument("-single", help="Merges all annotations into anchors.txt and counts them in memory",
+                        action="store_true", default=False)
     args = parser.parse_args()
 
-    merge_anchors(args.inputdir, args.outputdir + "/anchors.txt")
-    count_anchors(args.outputdir + "/anchors.txt", args.outputdir + "/anchors_count.txt")
+    if args.single:
+        merge_anchors(args.inputdir, args.outputdir + "/anchors.txt")
+        count_anchors(args.outputdir + "/anchors.txt", args.outputdir + "/anchors_count.txt")
+    else:
+        count_anchors_parallel(args.inputdir, args.outputdir + "/anchors_count.txt", args.workers, args.mem)
 
 if __name__ == "__main__":
     main()
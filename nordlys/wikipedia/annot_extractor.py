@@ -6,13 +6,28 @@ author: Faegheh Hasibi
 
 import argparse
 import os
-import re
 from datetime import datetime
+from nordlys.wikipedia.wiki_parser import parse_file
 
-tagRE = re.compile(r'(.*?)(<(/?\w+)[^>]*>)(?:([^<]*)(<.*?>)?)?')
-idRE = re.compile(r'id="([0-9]+)"')
-titleRE = re.compile(r'title="(.*)"')
-linkRE = re.compile(r'href="(.*)"')
+def get_annots(page_id, title, anchors, wiki_file=""):
+    """
+    Returns the annotations of an article as tsv lines.
+    line format: page_id   title   mention    linked_en
+
+    :param page_id: page id of the article
+    :param title: title of the article
+    :param anchors: list of (mention, link)
+    :param wiki_file: name of the file the article is read from (for logging)
+    """
+    if (page_id is None) or (title is None):
+        print "\nINFO: doc id or title not found in " + wiki_file,
+    annots = []
+    for mention, link in anchors:
+        if (link is None) or (page_id is None) or (title is None):
+            print "\nINFO: link not found in " + wiki_file,
+            continue
+        annots.append(page_id + "\t" + title + "\t" + mention + "\t" + link + "\n")
+    return annots
 
 
 def process_file(wiki_file, out_file):
@@ -24,35 +39,10 @@ def process_file(wiki_file, out_file):
     :param out_file: Name of tsv file.
     """
     print "Processing " + wiki_file + " ...",
-    open(out_file, "w").close()
-    out = open(out_file, "a")
-    f = open(wiki_file, "r")
-    annots = []
-    doc_id, doc_title = None, None
-    for line in f:
-        # Writes annotations and reset variables
-        if re.search(r'</doc>', line):
-            out.write("".join(annots))
-            annots = []
-            doc_id, doc_title = None, None
-        for m in tagRE.finditer(line):
-            if not m:
-                continue
-            tag = m.group(3)
-            if tag == "doc":
-                doc_id = idRE.search(m.group(2))
-                doc_title = titleRE.search(m.group(2))
-                if (not doc_id) or (not doc_title):
-                    print "\nINFO: doc id or title not found in " + wiki_file,
-                    continue
-            if tag == "a":
-                mention = m.group(4)
-                link = linkRE.search(m.group(2))
-                if (not link) or (doc_id is None) or (doc_title is None):
-                    print "\nINFO: link not found in " + wiki_file,
-                    continue
-                annot = doc_id.group(1) + "\t" + doc_title.group(1) + "\t" + mention + "\t" + link.group(1) + "\n"
-                annots.append(annot)
+    out = open(out_file, "w")
+    for page_id, title, _, anchors in parse_file(wiki_file):
+        out.write("".join(get_annots(page_id, title, anchors, wiki_file)))
+    out.close()
     print " --> output in " + out_file
 
 
@@ -1,30 +1,37 @@
 """
 Creates a Lucene index for Wikipedia articles.
 
-- A single field index is created.
+- A single field index is created; optionally, word n-grams of the text are also indexed into a shingles field
+  (for counting phrase frequencies with a single term lookup; see Lucene.get_ngram_freq).
 - disambiguation and list pages are ignored.
 - wiki page annotations are ignored and only mentions are kept.
+- with -workers, sub-indices are built in parallel processes and then merged into a single index.
 
 @author: Faegheh Hasibi (faegheh.hasibi@idi.ntnu.no)
 """
 import argparse
 import os
-import re
+import shutil
+import time
+from multiprocessing import Pool
 from urllib import unquote
 from nordlys.wikipedia.utils import WikipediaUtils
+from nordlys.wikipedia.wiki_parser import parse_file
 from nordlys.tagme.lucene_tools import Lucene
 
 
 class Indexer(object):
-    tagRE = re.compile(r'(.*?)(<(/?\w+)[^>]*>)(?:([^<]*)(<.*?>)?)?')
-    idRE = re.compile(r'id="([0-9]+)"')
-    titleRE = re.compile(r'title="(.*)"')
-    linkRE = re.compile(r'href="(.*)"')
 
-    def __init__(self, annot_only):
+    def __init__(self, annot_only, shingles=False):
+        """
+        :param annot_only: annotation-only index
+        :param shingles: indexes word n-grams of the text into the shingles field (full-text index only)
+        """
         self.annot_only = annot_only
+        self.shingles = shingles and not annot_only
         self.contents = None
         self.lucene = None
+        self.num_docs = 0
 
     def __add_to_contents(self, field_name, field_value, field_type):
         """
@@ -40,73 +47,99 @@ class Indexer(object):
                                       'field_value': field_value,
                                       'field_type': field_type})
 
+    @staticmethod
+    def get_article_uri(title, text):
+        """
+        Returns the Wikipedia uri of an article, or None if the article should not be indexed.
+        Articles with null titles, disambiguation pages and list pages are ignored.
+        """
+        wiki_uri = WikipediaUtils.wiki_title_to_uri(title) if title else None
+        # ignores null titles
+        if wiki_uri is None:
+            print "\tINFO: Null Wikipedia title!"
+        # ignores disambiguation pages
+        elif (wiki_uri.endswith("(disambiguation)>")) or \
+                ((len(text) < 200) and ("may refer to:" in text)):
+            print "\tINFO: disambiguation page " + wiki_uri + " ignored!"
+        # ignores list pages
+        elif (wiki_uri.startswith("<wikipedia:List_of")) or (wiki_uri.startswith("<wikipedia:Table_of")):
+            print "\tINFO: List page " + wiki_uri + " ignored!"
+        else:
+            return wiki_uri
+        return None
+
+    @staticmethod
+    def get_annot_uris(anchors, file_name=""):
+        """Returns Wikipedia uris of the anchors (i.e. annotations) of an article."""
+        annot_uris = []
+        for _, link in anchors:
+            link_uri = WikipediaUtils.wiki_title_to_uri(unquote(link)) if link else None
+            if link_uri is not None:
+                annot_uris.append(link_uri)
+            else:
+                print "\nINFO: link to the annotation not found in " + file_name
+        return annot_uris
+
+    def add_article(self, wiki_uri, text, annot_uris, update=False):
+        """
+        Adds an article to the index.
+
+        :param wiki_uri: Wikipedia uri of the article
+        :param text: article text (for the full-text index)
+        :param annot_uris: list of linked entities (for the annotation-only index)
+        :param update: replaces the article if it is already indexed
+        """
+        self.contents = []
+        self.__add_to_contents(Lucene.FIELDNAME_ID, wiki_uri, Lucene.FIELDTYPE_ID)
+        if self.annot_only:
+            self.__add_to_contents(Lucene.FIELDNAME_CONTENTS, annot_uris, Lucene.FIELDTYPE_ID_TV)
+        else:
+            self.__add_to_contents(Lucene.FIELDNAME_CONTENTS, text, Lucene.FIELDTYPE_TEXT_TVP)
+            if self.shingles:
+                self.__add_to_contents(Lucene.FIELDNAME_SHINGLES, text, Lucene.FIELDTYPE_SHINGLES)
+        if update:
+            self.lucene.update_document(wiki_uri, self.contents)
+        else:
+            self.lucene.add_document(self.contents)
+        self.contents = []
+        self.num_docs += 1
+
+    def delete_article(self, wiki_uri):
+        """Deletes an article from the index."""
+        self.lucene.delete_document(wiki_uri)
+
     def index_file(self, file_name):
         """
         Adds one file to the index.
 
         :param file_name: file to be indexed
         """
-        self.contents = []
-        article_text = ""
-        article_annots = []  # for annot-only index
-
-        f = open(file_name, "r")
-        for line in f:
-            line = line.replace("#redirect", "")
-            # ------ Reaches the end tag for an article ---------
-            if re.search(r'</doc>', line):
-                # ignores null titles
-                if wiki_uri is None:
-                    print "\tINFO: Null Wikipedia title!"
-                # ignores disambiguation pages
-                elif (wiki_uri.endswith("(disambiguation)>")) or \
-                        ((len(article_text) < 200) and ("may refer to:" in article_text)):
-                    print "\tINFO: disambiguation page " + wiki_uri + " ignored!"
-                # ignores list pages
-                elif (wiki_uri.startswith("<wikipedia:List_of")) or (wiki_uri.startswith("<wikipedia:Table_of")):
-                    print "\tINFO: List page " + wiki_uri + " ignored!"
-                # adds the document to the index
-                else:
-                    self.__add_to_contents(Lucene.FIELDNAME_ID, wiki_uri, Lucene.FIELDTYPE_ID)
-                    if self.annot_only:
-                        self.__add_to_contents(Lucene.FIELDNAME_CONTENTS, article_annots, Lucene.FIELDTYPE_ID_TV)
-                    else:
-                        self.__add_to_contents(Lucene.FIELDNAME_CONTENTS, article_text, Lucene.FIELDTYPE_TEXT_TVP)
-                    self.lucene.add_document(self.contents)
-                self.contents = []
-                article_text = ""
-                article_annots = []
-
-            # ------ Process other lines of article ---------
-            tag_iter = list(self.tagRE.finditer(line))
-            # adds line to content if there is no annotation
-            if len(tag_iter) == 0:
-                article_text += line
+        for _, title, text, anchors in parse_file(file_name):
+            wiki_uri = self.get_article_uri(title, text)
+            if wiki_uri is None:
                 continue
-            # A tag is detected in the line
-            for t in tag_iter:
-                tag = t.group(3)
-                if tag == "doc":
-                    doc_title = self.titleRE.search(t.group(2))
-                    wiki_uri = WikipediaUtils.wiki_title_to_uri(doc_title.group(1)) if doc_title else None
-                if tag == "a":
-                    article_text += t.group(1) + t.group(4)  # resolves annotations and replace them with mention
-                    # extracts only annotations
-                    if self.annot_only:
-                        link_title = self.linkRE.search(t.group(2))
-                        link_uri = WikipediaUtils.wiki_title_to_uri(unquote(link_title.group(1))) if link_title else None
-                        if link_uri is not None:
-                            article_annots.append(link_uri)
-                        else:
-                            print "\nINFO: link to the annotation not found in " + file_name
-            last_span = tag_iter[-1].span()
-            article_text += line[last_span[1]:]
-        f.close()
+            # extracts only annotations
+            annot_uris = self.get_annot_uris(anchors, file_name) if self.annot_only else []
+            self.add_article(wiki_uri, text, annot_uris)
+
+    def open(self, output_dir, ram_buffer_mb=None, append=False):
+        """Opens the index for writing (append: for updating an existing index)."""
+        self.lucene = Lucene(output_dir)
+        self.lucene.open_writer(ram_buffer_mb, append)
+
+    def close(self, merge_deletes=False):
+        """
+        Closes the index.
+
+        :param merge_deletes: merges away the deleted documents before closing (after updates)
+        """
+        if merge_deletes:
+            self.lucene.force_merge_deletes()
+        self.lucene.close_writer()
 
     def index_files(self, input_dir, output_dir):
         """Build index for all files."""
-        self.lucene = Lucene(output_dir)
-        self.lucene.open_writer()
+        self.open(output_dir)
         for path, dirs, _ in os.walk(input_dir):
             for dir in sorted(dirs):
                 for _, _, files in os.walk(os.path.join(input_dir, dir)):
@@ -114,7 +147,78 @@ class Indexer(object):
                         print "Indexing ", os.path.join(input_dir + dir, fn),  "..."
                         self.index_file(os.path.join(input_dir + dir, fn))
         # closes Lucene index
-        self.lucene.close_writer()
+        self.close()
+
+    def index_dirs(self, input_dir, dirs, output_dir, ram_buffer_mb=None, worker_id=0):
+        """
+        Builds index for the files of the given sub directories; reports progress and throughput.
+
+        :return: number of indexed documents
+        """
+        self.open(output_dir, ram_buffer_mb)
+        s_t = time.time()
+        for dir in dirs:
+            for _, _, files in os.walk(os.path.join(input_dir, dir)):
+                for fn in sorted(files):
+                    self.index_file(os.path.join(input_dir, dir, fn))
+            elapsed = time.time() - s_t
+            print "[worker " + str(worker_id) + "] " + dir + " done: " + str(self.num_docs) + " docs, " + \
+                  "%.1f docs/sec" % (self.num_docs / elapsed if elapsed > 0 else 0)
+        self.close()
+        return self.num_docs
+
+
+def index_worker(job):
+    """
+    Builds a sub-index in a worker process (with its own JVM).
+
+    :param job: (worker id, annot_only, shingles, input dir, list of sub directories, sub-index dir, RAM buffer size)
+    :return: (worker id, number of documents, elapsed time in seconds)
+    """
+    worker_id, annot_only, shingles, input_dir, dirs, output_dir, ram_buffer_mb = job
+    s_t = time.time()
+    num_docs = Indexer(annot_only, shingles).index_dirs(input_dir, dirs, output_dir, ram_buffer_mb, worker_id)
+    return worker_id, num_docs, time.time() - s_t
+
+
+def index_parallel(input_dir, output_dir, annot_only, num_workers, ram_buffer_mb=256, max_segments=0,
+                   shingles=False):
+    """
+    Builds the index with multiple worker processes: each worker indexes a disjoint slice of the sub directories
+    into its own sub-index; the sub-indices are then added to the final index.
+
+    :param input_dir: WikiExtractor output directory
+    :param output_dir: index directory
+    :param annot_only: annotation-only index
+    :param num_workers: number of worker processes
+    :param ram_buffer_mb: RAM buffer size (MB) of each worker's IndexWriter
+    :param max_segments: force-merges the final index into this number of segments (0: no force-merge)
+    :param shingles: indexes word n-grams into the shingles field
+    """
+    dirs = sorted(d for d in os.listdir(input_dir) if os.path.isdir(os.path.join(input_dir, d)))
+    sub_index_dir = output_dir.rstrip("/") + "-parts"
+    jobs = [(i, annot_only, shingles, input_dir, dirs[i::num_workers],
+             os.path.join(sub_index_dir, "part_%03d" % i), ram_buffer_mb) for i in range(num_workers)]
+    # the main process does not start the JVM before the workers are forked
+    pool = Pool(num_workers, maxtasksperchild=1)
+    total_docs = 0
+    for worker_id, num_docs, elapsed in pool.imap_unordered(index_worker, jobs):
+        total_docs += num_docs
+        print "[worker " + str(worker_id) + "] finished: " + str(num_docs) + " docs in %.1f sec (%.1f docs/sec)" % \
+            (elapsed, num_docs / elapsed if elapsed > 0 else 0)
+    pool.close()
+    pool.join()
+
+    print "Merging", num_workers, "sub-indices into", output_dir, "..."
+    s_t = time.time()
+    lucene = Lucene(output_dir)
+    lucene.open_writer(ram_buffer_mb)
+    lucene.add_indexes([job[5] for job in jobs])
+    if max_segments > 0:
+        lucene.force_merge(max_segments)
+    lucene.close_writer()
+    shutil.rmtree(sub_index_dir)
+    print total_docs, "docs are indexed; merging took %.1f sec" % (time.time() - s_t)
 
 
 def main():
@@ -122,14 +226,24 @@ def main():
     parser.add_argument("-inputdir", help="Path to directory to read from")
     parser.add_argument("-outputdir", help="Path to write the annotations (.tsv files)")
     parser.add_argument("-annot", help="Annotation-only index", action="store_true", default=False)
+    parser.add_argument("-workers", help="Number of worker processes (parallel build)", type=int, default=1)
+    parser.add_argument("-rambuffer", help="RAM buffer size (MB) of each worker", type=float, default=256)
+    parser.add_argument("-forcemerge", help="Maximum number of segments after the parallel build (0: no merge)",
+                        type=int, default=0)
+    parser.add_argument("-shingles", help="Indexes word n-grams (for computing link probabilities)",
+                        action="store_true", default=False)
 
     args = parser.parse_args()
 
     output_dir = args.outputdir
     input_dir = args.inputdir
     print "index dir: " + output_dir
-    indexer = Indexer(args.annot)
-    indexer.index_files(input_dir, output_dir)
+    if args.workers > 1:
+        index_parallel(input_dir, output_dir, args.annot, args.workers, args.rambuffer, args.forcemerge,
+                       args.shingles)
+    else:
+        indexer = Indexer(args.annot, args.shingles)
+        indexer.index_files(input_dir, output_dir)
     print "index build" + output_dir
 
 
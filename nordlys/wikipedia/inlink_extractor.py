@@ -0,0 +1,74 @@
+"""
+Extracts the in-link graph of entities from the annotation-only index (built by indexer.py with -annot) and
+writes it as a compact snapshot in CSR format. The snapshot is memory-mapped by nordlys.tagme.inlink_graph
+and replaces the Lucene AND queries used for computing relatedness.
+
+Files written into the output directory:
+  - entities.bin, en_offsets.npy: Entity URIs (utf-8), sorted (in the term order of the index); entity i is
+    entities[en_offsets[i]:en_offsets[i+1]].
+  - offsets.npy: Offsets of the entities in docs.npy; in-links of entity i are docs[offsets[i]:offsets[i+1]].
+  - docs.npy: Sorted Lucene doc ids of the articles linking to each entity.
+  - meta.json: Number of documents in the annotation index.
+
+@author: Faegheh Hasibi (faegheh.hasibi@idi.ntnu.no)
+"""
+
+import argparse
+import json
+import os
+from array import array
+import numpy as np
+from nordlys.tagme.lucene_tools import Lucene
+
+
+ENTITIES_FILE = "entities.bin"
+EN_OFFSETS_FILE = "en_offsets.npy"
+OFFSETS_FILE = "offsets.npy"
+DOCS_FILE = "docs.npy"
+META_FILE = "meta.json"
+
+
+def extract_inlinks(index_dir, output_dir):
+    """
+    Walks the posting lists of the annotation index and writes the in-link graph snapshot.
+
+    :param index_dir: path to the annotation-only index
+    :param output_dir: path to the snapshot directory
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    lucene = Lucene(index_dir)
+    offsets = array("l", [0])
+    docs = array("i")
+    en_offsets = array("l", [0])
+    en_file = open(os.path.join(output_dir, ENTITIES_FILE), "wb")
+    i = 0
+    # terms are iterated in sorted (utf-8 byte) order, so entities can be looked up by binary search
+    for en_uri, doc_ids in lucene.iter_postings(Lucene.FIELDNAME_CONTENTS):
+        en_uri = en_uri.encode("utf-8")
+        en_file.write(en_uri)
+        en_offsets.append(en_offsets[-1] + len(en_uri))
+        docs.extend(doc_ids)
+        offsets.append(len(docs))
+        i += 1
+        if i % 1000000 == 0:
+            print "Processed", i, "th entity!"
+    en_file.close()
+
+    np.save(os.path.join(output_dir, EN_OFFSETS_FILE), np.array(en_offsets, dtype=np.int64))
+    np.save(os.path.join(output_dir, OFFSETS_FILE), np.array(offsets, dtype=np.int64))
+    np.save(os.path.join(output_dir, DOCS_FILE), np.frombuffer(docs, dtype=np.int32))
+    json.dump({"num_docs": lucene.num_docs(), "num_entities": i}, open(os.path.join(output_dir, META_FILE), "w"))
+    print "In-links of", i, "entities are written to", output_dir
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-index", help="Path to the annotation-only index")
+    parser.add_argument("-outputdir", help="Path to write the in-link graph")
+    args = parser.parse_args()
+
+    extract_inlinks(args.index, args.outputdir)
+
+if __name__ == "__main__":
+    main()
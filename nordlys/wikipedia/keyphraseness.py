@@ -0,0 +1,102 @@
+"""
+Precomputes the number of Wikipedia articles containing each surface form (i.e. the denominator of
+link probability/keyphraseness) and stores it in the surface form collection, next to the anchor counts.
+
+Tagme then reads the link probability from the surface form record and does not run phrase queries at query time.
+Only the surface forms that can pass the mention filters of Tagme.parse() are counted; i.e., surface forms
+made of lowercased alphanumeric words (the output of Query.preprocess), with at most 6 words and
+at least 2 anchor occurrences.
+
+Phrase queries are run in parallel; each worker process starts its own JVM and opens its own index reader.
+
+@author: Faegheh Hasibi (faegheh.hasibi@idi.ntnu.no)
+"""
+
+import argparse
+import re
+from multiprocessing import Pool, cpu_count
+from nordlys.storage.surfaceforms import SurfaceForms
+from nordlys.tagme.lucene_tools import Lucene
+
+
+sfRE = re.compile(r'^[a-z0-9]+( [a-z0-9]+)*$')
+
+# Lucene index of the worker process
+worker_index = None
+
+
+def is_candidate(sf, anchors):
+    """Checks if the surface form can pass the mention filters of Tagme.parse()."""
+    if (len(sf) == 1) or sf.isdigit() or (len(sf.split()) > 6) or (not sfRE.match(sf)):
+        return False
+    return sum(anchors.itervalues()) >= 2
+
+
+def init_worker(index_dir):
+    """Opens the Lucene index in the worker process."""
+    global worker_index
+    worker_index = Lucene(index_dir, dir_mode=Lucene.DIR_MODE_MMAP)  # workers share the OS page cache
+    worker_index.open_searcher()
+
+
+def count_batch(sfs):
+    """
+    Counts the number of documents containing each surface form.
+
+    :param sfs: list of surface forms
+    :return: dictionary {surface_form: mention_freq, ...}
+    """
+    queries = [worker_index.get_phrase_query(sf, Lucene.FIELDNAME_CONTENTS) for sf in sfs]
+    return dict(zip(sfs, worker_index.count_many(queries)))
+
+
+def gen_batches(sf_dict, batch_size):
+    """Reads the surface form collection and generates batches of surface forms to be counted."""
+    batch = []
+    for doc in sf_dict.mongo.find_all(fields=["anchor"]):
+        sf = doc["_id"]
+        if not is_candidate(sf, doc.get("anchor", {})):
+            continue
+        batch.append(sf)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def compute_mention_freqs(index_dir, collection, num_workers, batch_size=1000):
+    """
+    Computes mention frequencies for all surface forms and writes them to the surface form collection.
+
+    :param index_dir: path to the full-text Wikipedia index
+    :param collection: name of the surface form collection
+    :param num_workers: number of worker processes
+    :param batch_size: number of surface forms sent to a worker (and written to MongoDB) at once
+    """
+    # the pool is created before connecting to MongoDB; the connection is not shared with the workers
+    pool = Pool(num_workers, initializer=init_worker, initargs=(index_dir,))
+    sf_dict = SurfaceForms(collection)
+    i = 0
+    for mention_freqs in pool.imap_unordered(count_batch, gen_batches(sf_dict, batch_size)):
+        sf_dict.set_mention_freqs(mention_freqs)
+        i += len(mention_freqs)
+        if i % 100000 < batch_size:
+            print "Processed", i, "th surface form!"
+    pool.close()
+    pool.join()
+    print "Mention frequency is added for", i, "surface forms."
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-index", help="Path to the full-text Wikipedia index")
+    parser.add_argument("-collection", help="Surface form collection (e.g. surfaceforms_wiki_20100408)")
+    parser.add_argument("-workers", help="Number of worker processes", type=int, default=cpu_count())
+    parser.add_argument("-batch", help="Number of surface forms per batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    compute_mention_freqs(args.index, args.collection, args.workers, args.batch)
+
+if __name__ == "__main__":
+    main()
@@ -4,42 +4,119 @@ which can be directly imported to Mongodb using this command:
 
  mongoimport --db <db_name> --collection surfaceforms_wiki_YYYYMMDD --file <path_to_json_file> --jsonArray
 
+Other output formats (-format):
+  - ndjson: one document per line, written while iterating over the surface forms (mongoimport without --jsonArray)
+  - mongo: documents are loaded directly to MongoDB (-collection) with unordered bulk inserts, by parallel writers
+
+With -shards, the merge takes bounded memory: the input records are hash-partitioned by surface form into shard
+files, each shard is merged independently (by -writers processes), and the merged shards are concatenated into a
+single ndjson file (or loaded to MongoDB).
+
 @author: Faegheh Hasibi (faegheh.hasibi@idi.ntnu.no)
 """
 import argparse
-
-import os
 import json
+import os
+import shutil
+import zlib
+from multiprocessing import Pool
 from urllib import unquote
+from nordlys.config import MONGO_DB, MONGO_HOST
 from nordlys.storage.mongo import Mongo
 from nordlys.wikipedia.utils import WikipediaUtils
 
 
+# MongoDB connection of the writer process
+writer_mongo = None
+
+
+def init_writer(collection):
+    """Connects the writer process to MongoDB."""
+    global writer_mongo
+    writer_mongo = Mongo(MONGO_HOST, MONGO_DB, collection)
+
+
+def write_batch(entries):
+    """Inserts a batch of documents; returns the number of documents."""
+    writer_mongo.insert_docs(entries)
+    return len(entries)
+
+
 class Merger(object):
 
     def __init__(self):
         self.all_sfs = {}
 
     def merge_all(self, titles_file, redirects_file, anchors_file, out_file):
+        self.add_all(titles_file, redirects_file, anchors_file)
+
+        # Converting all surface forms to mongo format
+        print "Converting to mongodb format ..."
+        sf_mongo_entries = list(self.gen_entries())
+        print "writing to json file ..."
+        json.dump(sf_mongo_entries, open(out_file, "w"), indent=4, sort_keys=True)
+
+    def add_all(self, titles_file, redirects_file, anchors_file):
         self.add_anchors(anchors_file)
         self.add_titles(titles_file)
         self.add_redirects(redirects_file)
 
-        # Converting all surface forms to mongo format
-        print "Converting to mongodb format ..."
-        sf_mongo_entries = []
+    def gen_entries(self, escape_values=False):
+        """
+        Generates the surface forms in mongo format.
+
+        :param escape_values: escapes the entity URIs too (MongoDB does not accept "." in inserted keys)
+        """
         i = 0
         for sf, en_sources in self.all_sfs.iteritems():
             escaped_sf = Mongo.escape(sf)
             entry = {"_id": escaped_sf}
             for source, en in en_sources.iteritems():
-                entry[source] = en
-            sf_mongo_entries.append(entry)
+                entry[source] = {Mongo.escape(k): v for k, v in en.iteritems()} if escape_values else en
+            yield entry
             i += 1
             if i % 1000000 == 0:
                 print "processes", i, "the surface form"
-        print "writing to json file ..."
-        json.dump(sf_mongo_entries, open(out_file, "w"), indent=4, sort_keys=True)
+
+    def write_ndjson(self, out_file):
+        """Writes the surface forms as newline-delimited json, one document at a time."""
+        with open(out_file, "w") as out:
+            for entry in self.gen_entries(escape_values=True):
+                out.write(json.dumps(entry, sort_keys=True) + "\n")
+
+    def gen_batches(self, batch_size):
+        """Generates batches of surface forms in mongo format."""
+        batch = []
+        for entry in self.gen_entries(escape_values=True):
+            batch.append(entry)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
+
+    def load_mongo(self, collection, batch_size=1000, num_writers=4, drop=False):
+        """
+        Loads the surface forms directly to MongoDB, using unordered bulk inserts.
+
+        :param collection: name of the surface form collection
+        :param batch_size: number of documents per insert
+        :param num_writers: number of parallel writer processes
+        :param drop: drops the collection before loading
+        """
+        mongo = Mongo(MONGO_HOST, MONGO_DB, collection)
+        if drop:
+            mongo.collection.drop()
+        # writers are forked after the surface forms are merged; each of them opens its own connection
+        pool = Pool(num_writers, initializer=init_writer, initargs=(collection,))
+        i = 0
+        for count in pool.imap_unordered(write_batch, self.gen_batches(batch_size)):
+            i += count
+            if i % 1000000 < batch_size:
+                print "Loaded", i, "th surface form!"
+        pool.close()
+        pool.join()
+        print i, "surface forms are loaded to", MONGO_DB + "." + collection
 
     def __add_to_dict(self, sf, pred, en, count=1):
         if sf not in self.all_sfs:
@@ -49,10 +126,20 @@ class Merger(object):
         else:
             self.all_sfs[sf][pred][en] = count
 
+    def add_records(self, records):
+        """Adds (surface form, source, wiki_uri, count) records to the surface form dictionary."""
+        for sf, pred, en, count in records:
+            self.__add_to_dict(sf, pred, en, count)
+
     # ============== ANCHORS ==============
 
     def add_anchors(self, anchor_file):
         print "Adding anchors ..."
+        self.add_records(self.read_anchors(anchor_file))
+
+    @staticmethod
+    def read_anchors(anchor_file):
+        """Generates (surface form, source, wiki_uri, count) records of anchors."""
         i = 0
         infile = open(anchor_file, "r")
         for line in infile:
@@ -61,7 +148,7 @@ class Merger(object):
             sf = cols[0].strip()
             count = int(cols[2])
             wiki_uri = WikipediaUtils.wiki_title_to_uri(unquote(cols[1].strip()))
-            self.__add_to_dict(sf, "anchor", wiki_uri, count)
+            yield sf, "anchor", wiki_uri, count
             i += 1
             if i % 1000000 == 0:
                 print "Processed", i, "th anchor!"
@@ -71,37 +158,59 @@ class Merger(object):
     def add_redirects(self, redirect_file):
         """Adds redirect pages to the surface form dictionary."""
         print "Adding redirects ..."
+        self.add_records(self.read_redirects(redirect_file))
+
+    @staticmethod
+    def read_redirects(redirect_file):
+        """Generates (surface form, source, wiki_uri, count) records of redirect pages."""
         redirects = open(redirect_file, "r")
         count = 0
         for line in redirects:
-            cols = line.strip().split("\t")
-            sf = cols[0].strip().lower()
-            wiki_uri = WikipediaUtils.wiki_title_to_uri(cols[1].strip())
-            # print sf, wiki_uri
-            self.__add_to_dict(sf, "redirect", wiki_uri)
+            yield Merger.redirect_record(line)
             count += 1
             if count % 1000000 == 0:
                 print "Processed ", count, "th redirects."
 
+    @staticmethod
+    def redirect_record(line):
+        """Returns the (surface form, source, wiki_uri, count) record of a redirect line."""
+        cols = line.strip().split("\t")
+        sf = cols[0].strip().lower()
+        wiki_uri = WikipediaUtils.wiki_title_to_uri(cols[1].strip())
+        # print sf, wiki_uri
+        return sf, "redirect", wiki_uri, 1
+
     # ============== TITLES ==============
 
     def add_titles(self, title_file):
         """Adds titles and title name variants to the surface form dictionary."""
         print "Adding titles ..."
+        self.add_records(self.read_titles(title_file))
+
+    @staticmethod
+    def read_titles(title_file):
+        """Generates (surface form, source, wiki_uri, count) records of titles and title name variants."""
         redirects = open(title_file, "r")
         count = 0
         for line in redirects:
             cols = line.strip().split("\t")
-            title = unquote(cols[1].strip())
-            wiki_uri = WikipediaUtils.wiki_title_to_uri(title)
-            self.__add_to_dict(title.lower(), "title", wiki_uri)
-            title_nv = self.__title_nv(title)
-            if (title_nv != title) and (title_nv.strip() != ""):
-                self.__add_to_dict(title_nv.lower(), "title-nv", wiki_uri)
+            for record in Merger.title_records(cols[1]):
+                yield record
             count += 1
             if count % 1000000 == 0:
                 print "Processed ", count, "th titles."
 
+    @staticmethod
+    def title_records(title):
+        """Returns the (surface form, source, wiki_uri, count) records of a page title (as in page-id-titles.txt)."""
+        title = unquote(title.strip())
+        wiki_uri = WikipediaUtils.wiki_title_to_uri(title)
+        records = [(title.lower(), "title", wiki_uri, 1)]
+        title_nv = Merger.__title_nv(title)
+        if (title_nv != title) and (title_nv.strip() != ""):
+            records.append((title_nv.lower(), "title-nv", wiki_uri, 1))
+        return records
+
     @staticmethod
     def __title_nv(title):
         """Removes all letters after "(" and "," from page title."""
@@ -112,18 +221,122 @@ class Merger(object):
         return title_nv.strip()
 
 
+def partition(titles_file, redirects_file, anchors_file, shard_dir, num_shards):
+    """
+    Writes the (surface form, source, wiki_uri, count) records of all inputs into shard files.
+    A surface form always goes to the same shard; records keep their order, so merging a shard gives the same
+    result as merging everything in memory.
+
+    :return: list of shard files
+    """
+    if not os.path.exists(shard_dir):
+        os.makedirs(shard_dir)
+    shard_files = [os.path.join(shard_dir, "shard_%04d.tsv" % i) for i in range(num_shards)]
+    shards = [open(shard_file, "w") for shard_file in shard_files]
+    for records in [Merger.read_anchors(anchors_file), Merger.read_titles(titles_file),
+                    Merger.read_redirects(redirects_file)]:
+        for sf, pred, en, count in records:
+            shard = (zlib.crc32(sf) & 0xffffffff) % num_shards
+            shards[shard].write(sf + "\t" + pred + "\t" + en + "\t" + str(count) + "\n")
+    for shard in shards:
+        shard.close()
+    return shard_files
+
+
+def read_shard(shard_file):
+    """Generates the records of a shard file."""
+    with open(shard_file, "r") as f:
+        for line in f:
+            sf, pred, en, count = line.rstrip("\n").split("\t")
+            yield sf, pred, en, int(count)
+
+
+def merge_shard(job):
+    """
+    Merges the surface forms of a shard and writes them as ndjson, or loads them to MongoDB.
+
+    :param job: (shard file, output file, collection or None, batch size)
+    :return: number of surface forms
+    """
+    shard_file, out_file, collection, batch_size = job
+    merger = Merger()
+    merger.add_records(read_shard(shard_file))
+    if collection is not None:
+        mongo = Mongo(MONGO_HOST, MONGO_DB, collection)
+        for batch in merger.gen_batches(batch_size):
+            mongo.insert_docs(batch)
+    else:
+        merger.write_ndjson(out_file)
+    return len(merger.all_sfs)
+
+
+def merge_sharded(titles_file, redirects_file, anchors_file, shard_dir, num_shards, num_workers, out_file=None,
+                  collection=None, batch_size=1000):
+    """
+    Merges the surface forms shard by shard; only one shard per worker is kept in memory.
+
+    :param shard_dir: directory for the shard files (removed at the end)
+    :param num_shards: number of shards
+    :param num_workers: number of shards merged in parallel
+    :param out_file: ndjson file of all surface forms (if collection is None)
+    :param collection: loads the surface forms to this collection instead of writing a file
+    :param batch_size: number of documents per bulk insert
+    """
+    print "Partitioning into", num_shards, "shards ..."
+    shard_files = partition(titles_file, redirects_file, anchors_file, shard_dir, num_shards)
+    jobs = [(shard_file, os.path.splitext(shard_file)[0] + ".ndjson", collection, batch_size)
+            for shard_file in shard_files]
+    pool = Pool(num_workers)
+    total = 0
+    for i, count in enumerate(pool.imap(merge_shard, jobs)):
+        total += count
+        print "Merged shard", i, "(" + str(count) + " surface forms)"
+    pool.close()
+    pool.join()
+
+    if collection is None:
+        print "Concatenating shards ..."
+        with open(out_file, "w") as out:
+            for _, shard_out_file, _, _ in jobs:
+                with open(shard_out_file, "r") as f:
+                    shutil.copyfileobj(f, out)
+    shutil.rmtree(shard_dir)
+    print total, "surface forms are merged."
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-anchors", help="Path to anchor file")
     parser.add_argument("-redirects", help="Path to redirect file")
     parser.add_argument("-titles", help="Path to page-title file")
     parser.add_argument("-outputdir", help="Path to output directory")
+    parser.add_argument("-format", help="Output format", choices=['json', 'ndjson', 'mongo'], default="json")
+    parser.add_argument("-collection", help="Surface form collection (for -format mongo)")
+    parser.add_argument("-batch", help="Number of documents per bulk insert", type=int, default=1000)
+    parser.add_argument("-writers", help="Number of parallel writers", type=int, default=4)
+    parser.add_argument("-drop", help="Drops the collection before loading", action="store_true", default=False)
+    parser.add_argument("-shards", help="Number of shards for a bounded-memory merge (ndjson or mongo format)",
+                        type=int, default=0)
     args = parser.parse_args()
 
-
     # Merges titles, redirects, and anchors
     merger = Merger()
-    merger.merge_all(args.titles, args.redirects, args.anchors, args.outputdir + "/sf_dict_mongo.json")
+    if args.shards > 0:
+        if args.format == "json":
+            raise Exception("Sharded merge writes ndjson or loads to MongoDB; use -format ndjson or mongo")
+        collection = args.collection if args.format == "mongo" else None
+        if (collection is not None) and args.drop:
+            Mongo(MONGO_HOST, MONGO_DB, collection).collection.drop()
+        merge_sharded(args.titles, args.redirects, args.anchors, args.outputdir + "/shards", args.shards,
+                      args.writers, args.outputdir + "/sf_dict_mongo.ndjson", collection, args.batch)
+    elif args.format == "json":
+        merger.merge_all(args.titles, args.redirects, args.anchors, args.outputdir + "/sf_dict_mongo.json")
+    elif args.format == "ndjson":
+        merger.add_all(args.titles, args.redirects, args.anchors)
+        merger.write_ndjson(args.outputdir + "/sf_dict_mongo.ndjson")
+    else:
+        merger.add_all(args.titles, args.redirects, args.anchors)
+        merger.load_mongo(args.collection, args.batch, args.writers, args.drop)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -6,33 +6,23 @@ Extracts page id and titles from Wikipedia dump and writes them into a single fi
 
 import argparse
 import os
-import re
+from nordlys.wikipedia.wiki_parser import parse_file
 
 
-tagRE = re.compile(r'(.*?)(<(/?\w+)[^>]*>)(?:([^<]*)(<.*?>)?)?')
-idRE = re.compile(r'id="([0-9]+)"')
-titleRE = re.compile(r'title="(.*)"')
+def get_line(page_id, title, file_name=""):
+    """Returns the page id and title of an article as a tsv line."""
+    if (page_id is None) or (title is None):
+        print "\nINFO: doc id or title not found in " + file_name,
+        return ""
+    return page_id + "\t" + title + "\n"
 
 
 def read_file(file_name):
     """Extracts page ids and titles from a single file."""
-    out_str = ""
-    f = open(file_name, "r")
-
-    for line in f:
-        for m in tagRE.finditer(line):
-            if not m:
-                continue
-            tag = m.group(3)
-            if tag == "doc":
-                doc_id = idRE.search(m.group(2))
-                doc_title = titleRE.search(m.group(2))
-                if (not doc_id) or (not doc_title):
-                    print "\nINFO: doc id or title not found in " + file_name,
-                    continue
-                out_str += doc_id.group(1) + "\t" + doc_title.group(1) + "\n"
-                break
-    return out_str
+    out_str = []
+    for page_id, title, _, _ in parse_file(file_name):
+        out_str.append(get_line(page_id, title, file_name))
+    return "".join(out_str)
 
 
 def read_files(basedir, output_file):
@@ -0,0 +1,165 @@
+"""
+Processes the WikiExtractor output in a single pass, producing the outputs of all extractors:
+  - annotation files (annotations/<dir>/an_<file>.tsv; see annot_extractor.py)
+  - page-id table (page-id-titles.txt; see pageid_extractor.py)
+  - full-text and annotation-only Lucene indices (index/ and index-annot/; see indexer.py)
+
+Files are split into contiguous slices, one per worker process; each article is parsed once (see wiki_parser.py).
+Each worker (with its own JVM) writes the annotation files and the page-id lines of its slice, and indexes the
+articles into its own sub-indices; articles are not sent back to the main process. When all workers are done, the
+page-id lines are concatenated in the file order and the sub-indices are added to the final indices (as in
+indexer.index_parallel).
+
+Usage: python -m nordlys.wikipedia.pipeline -inputdir <WikiExtractor dir> -outputdir <dir> -workers 8
+
+@author: Faegheh Hasibi (faegheh.hasibi@idi.ntnu.no)
+"""
+
+import argparse
+import os
+import shutil
+import time
+from multiprocessing import Pool, cpu_count
+from nordlys.wikipedia.wiki_parser import parse_file
+from nordlys.wikipedia.annot_extractor import get_annots
+from nordlys.wikipedia.pageid_extractor import get_line
+from nordlys.wikipedia.indexer import Indexer
+from nordlys.tagme.lucene_tools import Lucene
+
+PAGE_IDS_FILE = "page-id-titles.txt"
+INDEX_DIR = "index"
+ANNOT_INDEX_DIR = "index-annot"
+
+
+def get_files(input_dir):
+    """Returns (sub directory, file name) of all files, in the order the extractors process them."""
+    files = []
+    for path, dirs, _ in os.walk(input_dir):
+        for dir in sorted(dirs):
+            for _, _, fns in os.walk(os.path.join(input_dir, dir)):
+                for fn in sorted(fns):
+                    files.append((dir, fn))
+    return files
+
+
+def process_file(job):
+    """
+    Parses a file, writes its annotation file and prepares its articles for indexing.
+
+    :param job: (input file, annotation file)
+    :return: page-id lines, list of (wiki_uri, text, annot_uris) of the articles to be indexed
+    """
+    wiki_file, annot_file = job
+    page_ids = []
+    articles = []
+    with open(annot_file, "w") as out:
+        for page_id, title, text, anchors in parse_file(wiki_file):
+            out.write("".join(get_annots(page_id, title, anchors, wiki_file)))
+            page_ids.append(get_line(page_id, title, wiki_file))
+            wiki_uri = Indexer.get_article_uri(title, text)
+            if wiki_uri is not None:
+                articles.append((wiki_uri, text, Indexer.get_annot_uris(anchors, wiki_file)))
+    return "".join(page_ids), articles
+
+
+def process_files(job):
+    """
+    Processes a slice of files in a worker process: writes the annotation files and page-id lines of the slice and
+    indexes its articles into the sub-indices of the worker.
+
+    :param job: (worker id, list of (input file, annotation file), worker directory, shingles, RAM buffer size)
+    :return: (worker id, number of indexed articles, elapsed time in seconds)
+    """
+    worker_id, file_jobs, worker_dir, shingles, ram_buffer_mb = job
+    s_t = time.time()
+    indexer = Indexer(False, shingles)
+    indexer.open(os.path.join(worker_dir, INDEX_DIR), ram_buffer_mb)
+    annot_indexer = Indexer(True)
+    annot_indexer.open(os.path.join(worker_dir, ANNOT_INDEX_DIR), ram_buffer_mb)
+    with open(os.path.join(worker_dir, PAGE_IDS_FILE), "w") as page_id_file:
+        for i, file_job in enumerate(file_jobs):
+            page_ids, articles = process_file(file_job)
+            page_id_file.write(page_ids)
+            for wiki_uri, text, annot_uris in articles:
+                indexer.add_article(wiki_uri, text, annot_uris)
+                annot_indexer.add_article(wiki_uri, text, annot_uris)
+            if (i + 1) % 100 == 0:
+                print "[worker " + str(worker_id) + "] processed", i + 1, "files,", indexer.num_docs, \
+                    "articles indexed [%.1f min]" % ((time.time() - s_t) / 60)
+    indexer.close()
+    annot_indexer.close()
+    return worker_id, indexer.num_docs, time.time() - s_t
+
+
+def merge_indexes(index_dir, sub_index_dirs, ram_buffer_mb=None):
+    """Adds the sub-indices to the index."""
+    lucene = Lucene(index_dir)
+    lucene.open_writer(ram_buffer_mb)
+    lucene.add_indexes(sub_index_dirs)
+    lucene.close_writer()
+
+
+def run(input_dir, output_dir, num_workers, shingles=False, ram_buffer_mb=256):
+    """
+    Builds annotation files, the page-id table and both indices.
+
+    :param input_dir: WikiExtractor output directory
+    :param output_dir: output directory
+    :param num_workers: number of worker processes
+    :param shingles: indexes word n-grams into the shingles field of the full-text index
+    :param ram_buffer_mb: RAM buffer size (MB) of each IndexWriter
+    """
+    file_jobs = []
+    for dir, fn in get_files(input_dir):
+        annot_dir = os.path.join(output_dir, "annotations", dir)
+        if not os.path.exists(annot_dir):
+            os.makedirs(annot_dir)
+        file_jobs.append((os.path.join(input_dir, dir, fn), os.path.join(annot_dir, "an_" + fn + ".tsv")))
+
+    # contiguous slices, so that the page-id lines of the workers can be concatenated in the file order
+    parts_dir = os.path.join(output_dir, "parts")
+    slice_size = max(1, (len(file_jobs) + num_workers - 1) // num_workers)
+    jobs = []
+    for i, start in enumerate(range(0, len(file_jobs), slice_size)):
+        worker_dir = os.path.join(parts_dir, "part_%03d" % i)
+        if not os.path.exists(worker_dir):
+            os.makedirs(worker_dir)
+        jobs.append((i, file_jobs[start:start + slice_size], worker_dir, shingles, ram_buffer_mb))
+
+    # the main process does not start the JVM before the workers are forked
+    pool = Pool(num_workers, maxtasksperchild=1)
+    num_articles = 0
+    for worker_id, num_docs, elapsed in pool.imap_unordered(process_files, jobs):
+        num_articles += num_docs
+        print "[worker " + str(worker_id) + "] finished: " + str(num_docs) + " articles in %.1f sec" % elapsed
+    pool.close()
+    pool.join()
+
+    with open(os.path.join(output_dir, PAGE_IDS_FILE), "w") as page_id_file:
+        for job in jobs:
+            with open(os.path.join(job[2], PAGE_IDS_FILE), "r") as f:
+                shutil.copyfileobj(f, page_id_file)
+    print "Merging", len(jobs), "sub-indices ..."
+    s_t = time.time()
+    for index_dir in [INDEX_DIR, ANNOT_INDEX_DIR]:
+        merge_indexes(os.path.join(output_dir, index_dir), [os.path.join(job[2], index_dir) for job in jobs],
+                      ram_buffer_mb)
+    shutil.rmtree(parts_dir)
+    print len(file_jobs), "files are processed;", num_articles, "articles are indexed; merging took %.1f sec" % \
+        (time.time() - s_t)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-inputdir", help="Path to the WikiExtractor output")
+    parser.add_argument("-outputdir", help="Path to write the annotations, page ids and indices")
+    parser.add_argument("-workers", help="Number of worker processes", type=int, default=cpu_count())
+    parser.add_argument("-shingles", help="Indexes word n-grams (for computing link probabilities)",
+                        action="store_true", default=False)
+    parser.add_argument("-rambuffer", help="RAM buffer size (MB) of each worker", type=float, default=256)
+    args = parser.parse_args()
+
+    run(args.inputdir, args.outputdir, args.workers, args.shingles, args.rambuffer)
+
+if __name__ == "__main__":
+    main()
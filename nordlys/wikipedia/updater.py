@@ -0,0 +1,301 @@
+"""
+Incrementally updates the indices and the surface form collection from a newer Wikipedia dump
+(instead of rebuilding everything with annot_extractor, anchor_extractor, merge_sf, pageid_extractor and indexer).
+
+Articles are compared by page id and a fingerprint (md5) of their title, text and anchors:
+  - Lucene: changed and new articles are replaced/added, deleted and renamed ones are removed (both indices).
+  - Surface forms: anchor counts are adjusted by the difference between the old and new anchors of the changed
+    articles; titles of new, renamed and deleted articles and changed redirects are added/removed.
+    The old anchors are read from the annotation files of the old dump.
+Files are parsed by worker processes and the changes of each file are applied as soon as the file is processed, so
+the main process does not keep the changed articles in memory. Deleted documents are merged away before the indices
+are closed, as docFreq (e.g. of the shingles field) counts them until they are merged.
+The annotation files and fingerprints of the new dump are written to the output directory; they are the input of
+the next update.
+
+Snapshots built from the surface forms or the indices are stale after an update:
+  - Bloom filter of surface forms (-bloom; config.SF_FILTER_PATH): deleted, it is rebuilt when it is next loaded.
+  - Spotter (-spotter; config.SPOTTER_PATH): rebuilt from the updated collection.
+  - These should be rebuilt separately: the surface form store (nordlys.storage.sfstore), the in-link graph
+    (nordlys.wikipedia.inlink_extractor) and the mention frequencies (nordlys.wikipedia.keyphraseness).
+
+Fingerprints of a dump that is already processed (e.g. the old dump) are computed by:
+  python -m nordlys.wikipedia.updater -fingerprint -newdump <old dump> -outputdir <dir>
+
+@author: Faegheh Hasibi (faegheh.hasibi@idi.ntnu.no)
+"""
+
+import argparse
+import hashlib
+import os
+from collections import defaultdict
+from multiprocessing import Pool, cpu_count
+from urllib import unquote
+from nordlys.storage.surfaceforms import SurfaceForms
+from nordlys.tagme.spotter import Spotter
+from nordlys.wikipedia.wiki_parser import parse_file
+from nordlys.wikipedia.annot_extractor import get_annots
+from nordlys.wikipedia.anchor_extractor import get_tsv_files
+from nordlys.wikipedia.indexer import Indexer
+from nordlys.wikipedia.merge_sf import Merger
+from nordlys.wikipedia.pipeline import get_files
+from nordlys.wikipedia.utils import WikipediaUtils
+
+FINGERPRINTS_FILE = "fingerprints.txt"
+
+# fingerprints of the old dump {page_id: (title, fingerprint)}; set before the workers are forked
+OLD_FINGERPRINTS = {}
+
+# number of files submitted to the workers at a time, per worker
+FILES_PER_WORKER = 2
+
+
+def fingerprint(title, text, anchors):
+    """Returns the fingerprint of an article."""
+    md5 = hashlib.md5(title + "\n" + text)
+    for mention, link in anchors:
+        md5.update("\n" + mention + "\t" + str(link))
+    return md5.hexdigest()
+
+
+def read_fingerprints(fingerprints_file):
+    """Reads fingerprints {page_id: (title, fingerprint)}."""
+    fingerprints = {}
+    with open(fingerprints_file, "r") as f:
+        for line in f:
+            page_id, title, fp = line.rstrip("\n").split("\t")
+            fingerprints[page_id] = (title, fp)
+    return fingerprints
+
+
+def diff_file(job):
+    """
+    Finds the changed articles of a file and writes its annotation file.
+
+    :param job: (input file, annotation file)
+    :return: fingerprint lines, list of changed (or new) articles (page_id, title, text, anchors)
+    """
+    wiki_file, annot_file = job
+    fingerprints = []
+    changed = []
+    with open(annot_file, "w") as out:
+        for page_id, title, text, anchors in parse_file(wiki_file):
+            out.write("".join(get_annots(page_id, title, anchors, wiki_file)))
+            if (page_id is None) or (title is None):
+                continue
+            fp = fingerprint(title, text, anchors)
+            fingerprints.append(page_id + "\t" + title + "\t" + fp + "\n")
+            if OLD_FINGERPRINTS.get(page_id, None) != (title, fp):
+                changed.append((page_id, title, text, anchors))
+    return "".join(fingerprints), changed
+
+
+def read_annotations(annot_dir, page_ids):
+    """
+    Reads the annotations of the given pages from the annotation files.
+
+    :return: generator of annotation lines
+    """
+    for tsv_file in get_tsv_files(annot_dir):
+        with open(tsv_file, "r") as f:
+            for line in f:
+                if line[:line.find("\t")] in page_ids:
+                    yield line
+
+
+def add_anchor_deltas(annot_lines, sign, deltas):
+    """Adds the anchor-entity pairs of annotation lines to deltas (same normalization as anchor counting)."""
+    for line in annot_lines:
+        cols = line.strip().split("\t")
+        if (len(cols) < 4) or (cols[2].strip().lower() == ""):
+            continue
+        sf = cols[2].strip().lower()
+        wiki_uri = WikipediaUtils.wiki_title_to_uri(unquote(cols[3].strip()))
+        deltas[(sf, wiki_uri)] += sign
+
+
+def get_title_pairs(titles):
+    """Returns (surface_form, source, wiki_uri) of titles and title name variants."""
+    return [(sf, source, en) for title in titles for sf, source, en, _ in Merger.title_records(title)]
+
+
+def diff_redirects(old_file, new_file):
+    """Returns removed and added redirect records."""
+    old_lines = set(open(old_file, "r").read().splitlines())
+    new_lines = set(open(new_file, "r").read().splitlines())
+    removed = [Merger.redirect_record(line) for line in old_lines - new_lines if line.strip() != ""]
+    added = [Merger.redirect_record(line) for line in new_lines - old_lines if line.strip() != ""]
+    return removed, added
+
+
+def compute_fingerprints(dump_dir, output_dir, num_workers):
+    """Computes fingerprints (and annotation files) of a dump."""
+    pool = Pool(num_workers)
+    fingerprints_file = os.path.join(output_dir, FINGERPRINTS_FILE)
+    for _ in process_dump(pool, num_workers, dump_dir, output_dir, fingerprints_file, set()):
+        pass
+    pool.close()
+    pool.join()
+
+
+def process_dump(pool, num_workers, dump_dir, output_dir, fingerprints_file, page_ids):
+    """
+    Parses the dump with the worker pool and writes its fingerprints (in file order).
+    Files are submitted in chunks, so that the results of the workers do not pile up in the main process.
+
+    :param pool: pool of num_workers worker processes
+    :param page_ids: set, filled with the page ids of the dump
+    :return: generator of the changed (or new) articles of each file [(page_id, title, text, anchors), ...]
+    """
+    jobs = []
+    for dir, fn in get_files(dump_dir):
+        annot_dir = os.path.join(output_dir, "annotations", dir)
+        if not os.path.exists(annot_dir):
+            os.makedirs(annot_dir)
+        jobs.append((os.path.join(dump_dir, dir, fn), os.path.join(annot_dir, "an_" + fn + ".tsv")))
+    chunk_size = FILES_PER_WORKER * num_workers
+    num_files, num_changed = 0, 0
+    with open(fingerprints_file, "w") as fp_file:
+        for start in range(0, len(jobs), chunk_size):
+            for file_fingerprints, file_changed in pool.imap(diff_file, jobs[start:start + chunk_size]):
+                fp_file.write(file_fingerprints)
+                page_ids.update(line[:line.find("\t")] for line in file_fingerprints.splitlines())
+                num_files += 1
+                num_changed += len(file_changed)
+                if num_files % 100 == 0:
+                    print "Processed", num_files, "files;", num_changed, "changed articles"
+                yield file_changed
+
+
+def update(old_fingerprints_file, old_annot_dir, new_dump_dir, output_dir, index_dir, annot_index_dir, collection,
+           old_redirects=None, new_redirects=None, num_workers=1, shingles=False, bloom_file=None, spotter_dir=None):
+    """
+    Updates the indices and surface forms with the changes of the new dump.
+
+    :param old_fingerprints_file: fingerprints of the old dump
+    :param old_annot_dir: annotation files of the old dump
+    :param new_dump_dir: WikiExtractor output of the new dump
+    :param output_dir: directory for the annotation files and fingerprints of the new dump
+    :param index_dir: full-text index (updated)
+    :param annot_index_dir: annotation-only index (updated)
+    :param collection: surface form collection (updated)
+    :param old_redirects: redirects file of the old dump (optional)
+    :param new_redirects: redirects file of the new dump (optional)
+    :param num_workers: number of worker processes
+    :param shingles: the full-text index has the shingles field (see indexer.py)
+    :param bloom_file: bloom filter of the surface forms (deleted; optional)
+    :param spotter_dir: spotter of the surface forms (rebuilt; optional)
+    """
+    global OLD_FINGERPRINTS
+    OLD_FINGERPRINTS = read_fingerprints(old_fingerprints_file)
+    print "Old dump:", len(OLD_FINGERPRINTS), "articles"
+
+    # ------ Lucene indices (and anchors of the changed articles) ---------
+    # workers are forked before the JVM is started by the indexers
+    pool = Pool(num_workers)
+    indexer = Indexer(False, shingles)
+    indexer.open(index_dir, append=True)
+    annot_indexer = Indexer(True)
+    annot_indexer.open(annot_index_dir, append=True)
+    # fingerprints of the new dump are written to a temporary file until the update is done
+    fingerprints_file = os.path.join(output_dir, FINGERPRINTS_FILE)
+    new_page_ids, changed_page_ids = set(), set()
+    # uris of the articles written in this update; deleting an old uri would also delete the article written with
+    # the same uri (e.g. a new page with the title of a renamed or deleted page), so these are not deleted
+    written_uris = set()
+    old_titles, new_titles = [], []
+    deltas = defaultdict(int)
+    changes = process_dump(pool, num_workers, new_dump_dir, output_dir, fingerprints_file + ".tmp", new_page_ids)
+    for changed in changes:
+        for page_id, title, text, anchors in changed:
+            changed_page_ids.add(page_id)
+            add_anchor_deltas(get_annots(page_id, title, anchors), 1, deltas)
+            old = OLD_FINGERPRINTS.get(page_id, None)
+            wiki_uri = Indexer.get_article_uri(title, text)
+            if (old is not None) and (old[0] != title):
+                old_titles.append(old[0])
+            if (old is None) or (old[0] != title):
+                new_titles.append(title)
+            # the article is removed if it is renamed or should not be indexed anymore
+            old_uri = WikipediaUtils.wiki_title_to_uri(old[0]) if old is not None else None
+            if (old_uri is not None) and (old_uri != wiki_uri) and (old_uri not in written_uris):
+                indexer.delete_article(old_uri)
+                annot_indexer.delete_article(old_uri)
+            if wiki_uri is not None:
+                written_uris.add(wiki_uri)
+                annot_uris = Indexer.get_annot_uris(anchors)
+                indexer.add_article(wiki_uri, text, annot_uris, update=True)
+                annot_indexer.add_article(wiki_uri, text, annot_uris, update=True)
+    pool.close()
+    pool.join()
+    deleted = [page_id for page_id in OLD_FINGERPRINTS if page_id not in new_page_ids]
+    print len(changed_page_ids), "changed or new articles,", len(deleted), "deleted articles"
+    for page_id in deleted:
+        old_title = OLD_FINGERPRINTS[page_id][0]
+        old_titles.append(old_title)
+        old_uri = WikipediaUtils.wiki_title_to_uri(old_title)
+        if old_uri not in written_uris:
+            indexer.delete_article(old_uri)
+            annot_indexer.delete_article(old_uri)
+    indexer.close(merge_deletes=True)
+    annot_indexer.close(merge_deletes=True)
+    print "Indices are updated."
+
+    # ------ Surface forms ---------
+    sf_dict = SurfaceForms(collection)
+    add_anchor_deltas(read_annotations(old_annot_dir, changed_page_ids | set(deleted)), -1, deltas)
+    sf_dict.update_entity_counts("anchor", deltas)
+    print "Anchor counts are updated (" + str(len(deltas)) + " anchor-entity pairs)."
+
+    removed, added = get_title_pairs(old_titles), get_title_pairs(new_titles)
+    if (old_redirects is not None) and (new_redirects is not None):
+        removed_redirects, added_redirects = diff_redirects(old_redirects, new_redirects)
+        removed += [(sf, source, en) for sf, source, en, _ in removed_redirects]
+        added += [(sf, source, en) for sf, source, en, _ in added_redirects]
+    for source in ["title", "title-nv", "redirect"]:
+        sf_dict.remove_entities(source, [(sf, en) for sf, s, en in removed if s == source])
+        sf_dict.set_entities(source, [(sf, en) for sf, s, en in added if s == source])
+    print "Titles and redirects are updated (" + str(len(removed)) + " removed, " + str(len(added)) + " added)."
+
+    # ------ Snapshots of the surface forms ---------
+    if (bloom_file is not None) and os.path.exists(bloom_file):
+        os.remove(bloom_file)
+        print "Bloom filter " + bloom_file + " is deleted (rebuilt when it is next loaded)."
+    if spotter_dir is not None:
+        Spotter.build(collection).save(spotter_dir)
+        print "Spotter is rebuilt in " + spotter_dir
+    print "NOTE: the surface form store, in-link graph and mention frequencies should be rebuilt."
+
+    os.rename(fingerprints_file + ".tmp", fingerprints_file)
+    print "Fingerprints and annotations of the new dump are written to", output_dir
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-fingerprint", help="Only computes fingerprints of -newdump", action="store_true",
+                        default=False)
+    parser.add_argument("-oldfingerprints", help="Fingerprints file of the old dump")
+    parser.add_argument("-oldannots", help="Annotation directory of the old dump")
+    parser.add_argument("-oldredirects", help="Redirects file of the old dump")
+    parser.add_argument("-newdump", help="Path to the WikiExtractor output of the new dump")
+    parser.add_argument("-newredirects", help="Redirects file of the new dump")
+    parser.add_argument("-outputdir", help="Path to write the annotations and fingerprints of the new dump")
+    parser.add_argument("-index", help="Full-text index to be updated")
+    parser.add_argument("-annotindex", help="Annotation-only index to be updated")
+    parser.add_argument("-collection", help="Surface form collection to be updated")
+    parser.add_argument("-workers", help="Number of worker processes", type=int, default=cpu_count())
+    parser.add_argument("-shingles", help="The full-text index has word n-grams (built with -shingles)",
+                        action="store_true", default=False)
+    parser.add_argument("-bloom", help="Bloom filter file of the surface forms (deleted after the update)")
+    parser.add_argument("-spotter", help="Spotter directory (rebuilt after the update)")
+    args = parser.parse_args()
+
+    if args.fingerprint:
+        compute_fingerprints(args.newdump, args.outputdir, args.workers)
+    else:
+        update(args.oldfingerprints, args.oldannots, args.newdump, args.outputdir, args.index, args.annotindex,
+               args.collection, args.oldredirects, args.newredirects, args.workers, args.shingles, args.bloom,
+               args.spotter)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Streaming parser for Wikipedia articles processed by WikiExtractor.
+
+Each article is parsed once into a (page_id, title, text, anchors) record, which is shared by the
+indexer, annotation extractor and page-id extractor:
+  - page_id, title: attributes of the <doc> tag (None if missing)
+  - text: article text where links are replaced by their mentions ("#redirect" is removed)
+  - anchors: list of (mention, link) of the article; link is the (url-encoded) href, or None if missing
+
+@author: Faegheh Hasibi (faegheh.hasibi@idi.ntnu.no)
+"""
+
+import re
+
+tagRE = re.compile(r'(.*?)(<(/?\w+)[^>]*>)(?:([^<]*)(<.*?>)?)?')
+idRE = re.compile(r'id="([0-9]+)"')
+titleRE = re.compile(r'title="(.*)"')
+linkRE = re.compile(r'href="(.*)"')
+
+
+def parse_file(file_name):
+    """
+    Parses articles of a WikiExtractor file.
+
+    :param file_name: file containing multiple articles
+    :return: generator of (page_id, title, text, anchors)
+    """
+    page_id, title = None, None
+    text = []
+    anchors = []
+    with open(file_name, "r") as f:
+        for line in f:
+            line = line.replace("#redirect", "")
+            # ------ Reaches the end tag for an article ---------
+            if re.search(r'</doc>', line):
+                yield page_id, title, "".join(text), anchors
+                page_id, title = None, None
+                text = []
+                anchors = []
+
+            # ------ Process other lines of article ---------
+            tag_iter = list(tagRE.finditer(line))
+            # adds line to content if there is no annotation
+            if len(tag_iter) == 0:
+                text.append(line)
+                continue
+            # A tag is detected in the line
+            for t in tag_iter:
+                tag = t.group(3)
+                if tag == "doc":
+                    doc_id = idRE.search(t.group(2))
+                    doc_title = titleRE.search(t.group(2))
+                    page_id = doc_id.group(1) if doc_id else None
+                    title = doc_title.group(1) if doc_title else None
+                if tag == "a":
+                    text.append(t.group(1) + t.group(4))  # resolves annotations and replace them with mention
+                    link = linkRE.search(t.group(2))
+                    anchors.append((t.group(4), link.group(1) if link else None))
+            last_span = tag_iter[-1].span()
+            text.append(line[last_span[1]:])